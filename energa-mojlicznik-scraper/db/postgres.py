@@ -1,3 +1,5 @@
+import csv
+import io
 from datetime import datetime, timedelta
 
 import psycopg2
@@ -5,8 +7,10 @@ from psycopg2.extras import execute_batch
 
 
 class PostgreSQL:
-    def __init__(self, url):
+    def __init__(self, url, copy_threshold=500):
         self.url = url
+        # smaller batches are inserted row by row, staging table isn't worth it
+        self.copy_threshold = copy_threshold
         self.conn = None
 
     def ensure_initialized(self):
@@ -40,22 +44,56 @@ class PostgreSQL:
 
     def save(self, data):
         self.ensure_initialized()
+        rows = [
+            (
+                status.ts,
+                status.ts.replace(tzinfo=None),
+                status.meter.name,
+                status.meter.tariff,
+                status.imported,
+                status.exported,
+            )
+            for status in data
+        ]
         cur = self.conn.cursor()
+        try:
+            if len(rows) >= self.copy_threshold:
+                self.copy(cur, rows)
+            else:
+                self.insert(cur, rows)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def insert(self, cur, rows):
         insert = "INSERT INTO energy(ts, ts_local, meter, tariff, imported, exported) VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING"
+        execute_batch(cur, insert, rows)
 
-        execute_batch(
-            cur,
-            insert,
-            [
-                (
-                    status.ts,
-                    status.ts.replace(tzinfo=None),
-                    status.meter.name,
-                    status.meter.tariff,
-                    status.imported,
-                    status.exported,
-                )
-                for status in data
-            ],
+    def copy(self, cur, rows):
+        """Streams rows into a staging table, then merges them into energy at once"""
+        # ts stays timestamptz here, so it's converted to timestamp by the same
+        # rules as parameters of the row-by-row insert
+        cur.execute(
+            """
+        CREATE TEMP TABLE energy_staging (
+            ts timestamp with time zone,
+            ts_local timestamp without time zone,
+            meter text,
+            tariff varchar(4),
+            imported integer,
+            exported integer
+        ) ON COMMIT DROP"""
+        )
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cur.copy_expert(
+            "COPY energy_staging FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (meter))",
+            buffer,
+        )
+        cur.execute(
+            "INSERT INTO energy (ts, ts_local, meter, tariff, imported, exported) "
+            "SELECT ts, ts_local, meter, tariff, imported, exported FROM energy_staging "
+            "ON CONFLICT DO NOTHING"
         )
-        self.conn.commit()
@@ -10,6 +10,12 @@ parser = argparse.ArgumentParser()
 parser.add_argument("--mojlicznik-user", required=True)
 parser.add_argument("--mojlicznik-password", required=True)
 parser.add_argument("--postgres-url", required=False)
+parser.add_argument(
+    "--postgres-copy-threshold",
+    type=int,
+    default=500,
+    help="Batches of at least this many rows are loaded to PostgreSQL with COPY",
+)
 parser.add_argument("--influxdb-url", required=False)
 
 args = parser.parse_args()
@@ -22,7 +28,10 @@ dbs = []
 if args.influxdb_url is not None:
     dbs.append(("InfluxDB", InfluxDB(args.influxdb_url)))
 if args.postgres_url is not None:
-    dbs.append(("PostgreSQL", PostgreSQL(args.postgres_url)))
+    postgres = PostgreSQL(
+        args.postgres_url, copy_threshold=args.postgres_copy_threshold
+    )
+    dbs.append(("PostgreSQL", postgres))
 
 db_last_date = dbs[-1][1].get_last_date()
 logging.info("Last date for %s is %s", dbs[-1][0], db_last_date)
@@ -1,25 +1,117 @@
 import base64
+import bisect
 import codecs
+import copy
 import hashlib
+import itertools
+import json
 import logging
+import math
+import os
 import re
+import threading
 import time
-from collections import defaultdict
+from array import array
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
 
 import backoff
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import pkcs1
 import rsa
 
 
-@dataclass
-class Stats:
-    ts: datetime
-    values: dict
+class StatsBatch:
+    """History rows of a device, kept in columns.
+
+    Rows share one schema, codes of signals, each with a column of values
+    aligned with timestamps. Rows and slices are views of the columns, so
+    nothing is copied until an output reads the values.
+    """
+
+    def __init__(self, device, timezone, timestamps, codes, columns):
+        self.device = device
+        self.timezone = timezone
+        self.timestamps = timestamps  # ascending epoch seconds
+        self.codes = codes
+        self.positions = {code: i for i, code in enumerate(codes)}
+        self.columns = columns
+        self.start = 0
+        self.stop = len(timestamps)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("StatsBatch slices can't have a step")
+            view = copy.copy(self)
+            view.start = self.start + start
+            view.stop = self.start + max(start, stop)
+            return view
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(key)
+        return StatsRow(self, self.start + key)
+
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield StatsRow(self, i)
+
+    def since(self, ts):
+        """Rows newer than ts"""
+        i = bisect.bisect_right(self.timestamps, ts.timestamp(), self.start, self.stop)
+        return self[i - self.start :]
+
+    def times(self):
+        return [
+            datetime.fromtimestamp(ts, tz=self.timezone)
+            for ts in self.timestamps[self.start : self.stop]
+        ]
+
+    def column(self, code):
+        """Values of a signal in the rows, all None if it's not in the schema"""
+        if code not in self.positions:
+            return itertools.repeat(None, len(self))
+        return itertools.islice(
+            self.columns[self.positions[code]], self.start, self.stop
+        )
+
+
+class StatsRow:
+    """Row of a StatsBatch, reading straight from its columns"""
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def __repr__(self):
+        return f"StatsRow({self.ts}, {dict(self.values)})"
+
+    @property
+    def ts(self):
+        return datetime.fromtimestamp(
+            self.batch.timestamps[self.index], tz=self.batch.timezone
+        )
+
+    @property
+    def device(self):
+        return self.batch.device
+
+    @property
+    def values(self):
+        return RowValues(self.batch, self.index)
 
     def get_daily_energy_wh(self):
         return self.values["day_cap"] * 1000
@@ -28,6 +120,54 @@ class Stats:
         return self.values["active_power"] * 1000
 
 
+class RowValues(Mapping):
+    """Values of a StatsRow by signal code"""
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def __getitem__(self, code):
+        return self.batch.columns[self.batch.positions[code]][self.index]
+
+    def __iter__(self):
+        return iter(self.batch.codes)
+
+    def __len__(self):
+        return len(self.batch.codes)
+
+
+def merge_columns(parts, codes):
+    """Outer joins (timestamps, columns) parts on timestamp.
+
+    Returns ascending timestamps and a column aligned with them for each code,
+    None where a part has no sample.
+    """
+    timestamps = array(
+        "d", sorted(set(itertools.chain.from_iterable(ts for ts, _ in parts)))
+    )
+    columns = dict.fromkeys(codes)
+    index = None
+    for part_timestamps, part_columns in parts:
+        for code, values in part_columns.items():
+            if columns[code] is None and part_timestamps == timestamps:
+                columns[code] = list(values)
+                continue
+            if columns[code] is None:
+                columns[code] = [None] * len(timestamps)
+            if index is None:
+                index = {ts: i for i, ts in enumerate(timestamps)}
+            column = columns[code]
+            for ts, value in zip(part_timestamps, values):
+                column[index[ts]] = value
+    for code, column in columns.items():
+        if column is None:
+            columns[code] = [None] * len(timestamps)
+    return timestamps, columns
+
+
 @dataclass
 class SignalSet:
     signals: list
@@ -43,6 +183,15 @@ class SignalSet:
             by_unit[signal.unit].signals.append(signal)
         return by_unit
 
+    @staticmethod
+    def union(signal_sets):
+        """Signals present in any of the sets, each code once"""
+        by_code = {}
+        for signal_set in signal_sets:
+            for signal in signal_set.signals:
+                by_code.setdefault(signal.get_code(), signal)
+        return SignalSet(list(by_code.values()))
+
     def get_ids(self):
         return [signal.id for signal in self.signals]
 
@@ -95,7 +244,20 @@ class FusionSolarException(Exception):
 
 
 class FusionSolar:
-    def __init__(self, username, password, timezone, region, station_id=None):
+    def __init__(
+        self,
+        username,
+        password,
+        timezone,
+        region,
+        station_id=None,
+        max_workers=4,
+        pool_size=None,
+        retries=3,
+        session_cache=None,
+        session_max_age=timedelta(hours=12),
+        history_cache=None,
+    ):
         self.username = username
         self.password = password
         self.timezone = timezone
@@ -106,6 +268,26 @@ class FusionSolar:
         self.api_base = None
         self.csrf = None
         self.csrf_time = None
+        self.login_time = None
+        self.session_cache = session_cache
+        self.session_max_age = session_max_age
+        self.history_cache = history_cache
+        self.mixed_units = None
+        self.history_calls = 0
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # one keep-alive connection pool for all traffic, so TLS handshake
+        # with the region host happens once, not on every call
+        self.http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size or max_workers,
+            max_retries=Retry(
+                total=retries, backoff_factor=0.5, status_forcelist=[502, 503, 504]
+            ),
+        )
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
 
     @backoff.on_exception(
         backoff.expo,
@@ -113,24 +295,35 @@ class FusionSolar:
         max_time=7200,
     )
     def call_api(self, endpoint, method="get", params={}):
+        return self.call_api_once(endpoint, method, params)
+
+    def call_api_once(self, endpoint, method="get", params={}):
+        """Calls the API with no retries, except logging in again once expired"""
         if self.session is None or self.api_base is None:
-            self.login()
+            with self.lock:
+                if self.session is None or self.api_base is None:
+                    if not self.restore_session():
+                        self.login()
 
+        session = self.session
         self.refresh_csrf()
         url = f"{self.api_base}/{endpoint}"
-        func = getattr(requests, method)
+        func = getattr(self.http, method)
         response = func(
             url=url,
             params=params if method == "get" else None,
-            cookies={"dp-session": self.session},
+            cookies={"dp-session": session},
             headers={"roarand": self.csrf},
             timeout=60,
             json=params if method == "post" else None,
         )
 
         if "Content-Type" in response.headers and response.headers["Content-Type"].startswith("text/html"):
-            self.login()
-            return self.call_api(endpoint, method, params)
+            with self.lock:
+                # another thread may have logged in already
+                if self.session == session:
+                    self.login()
+            return self.call_api_once(endpoint, method, params)
 
         if response.status_code != 200:
             raise FusionSolarException(
@@ -144,7 +337,8 @@ class FusionSolar:
 
     def login(self):
         login_url = f"https://{self.region}.fusionsolar.huawei.com/unisso/login.action"
-        session = requests.Session()
+        session = self.http
+        session.cookies.clear()
         login_page = session.get(login_url).text
         assert (
             "ssoCredentials.verifyCode" not in login_page
@@ -192,48 +386,130 @@ class FusionSolar:
         api_server_redirect = session.get(url)
         self.api_base = f"https://{urlparse(api_server_redirect.url).netloc}"
         self.session = session.cookies["dp-session"]
+        self.login_time = datetime.now()
+        self.csrf = None
         self.station = self.station_id or self.get_station_id()
         logging.info(
             f"Login successful, session: {self.session}, station: {self.station}"
         )
+        self.save_session()
+
+    def restore_session(self):
+        """Reuses session saved by previous run, if it's fresh and still accepted"""
+        if self.session_cache is None:
+            return False
+        try:
+            with open(self.session_cache) as cache:
+                cached = json.load(cache)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        login_time = datetime.fromisoformat(cached["login_time"])
+        if (
+            cached["username"] != self.username
+            or cached["region"] != self.region
+            or datetime.now() - login_time > self.session_max_age
+        ):
+            logging.info("Cached FusionSolar session expired")
+            return False
+
+        self.session = cached["session"]
+        self.api_base = cached["api_base"]
+        self.station = cached["station"]
+        self.login_time = login_time
+        self.csrf = None
+        try:
+            self._refresh_csrf()  # keep-alive tells if the session is still valid
+        except (requests.exceptions.RequestException, KeyError, ValueError):
+            logging.info("Cached FusionSolar session rejected, logging in")
+            self.session = self.api_base = self.station = None
+            return False
+
+        logging.info(
+            f"Restored session from {self.session_cache}, station: {self.station}"
+        )
+        return True
+
+    def save_session(self):
+        if self.session_cache is None:
+            return
+        cached = {
+            "username": self.username,
+            "region": self.region,
+            "session": self.session,
+            "api_base": self.api_base,
+            "station": self.station,
+            "csrf": self.csrf,
+            "csrf_time": self.csrf_time.isoformat() if self.csrf_time else None,
+            "login_time": self.login_time.isoformat(),
+        }
+        # the file holds a live session cookie, keep it private
+        tmp = f"{self.session_cache}.tmp"
+        with os.fdopen(
+            os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w"
+        ) as cache:
+            json.dump(cached, cache)
+        os.replace(tmp, self.session_cache)
 
     def refresh_csrf(self):
+        with self.lock:
+            self._refresh_csrf()
+
+    def _refresh_csrf(self):
         if self.csrf is None or datetime.now() - self.csrf_time > timedelta(minutes=5):
-            self.csrf = requests.get(
+            self.csrf = self.http.get(
                 f"{self.api_base}/rest/dpcloud/auth/v1/keep-alive",
                 cookies={"dp-session": self.session},
             ).json()["payload"]
             self.csrf_time = datetime.now()
             logging.debug(f"CSRF refreshed: {self.csrf}")
+            self.save_session()
 
     def get_station_id(self):
-        station_info = self.call_api(
-            "rest/pvms/web/station/v1/station/station-list",
-            method="post",
-            params={
-                "curPage": 1,
-                "pageSize": 10,
-                "gridConnectedTime": "",
-                "queryTime": 1666044000000,
-                "timeZone": 2,
-                "sortId": "createTime",
-                "sortDir": "DESC",
-                "locale": "en_US",
-            },
-        )
-        logging.debug("Station info: %s", station_info["data"])
-        return station_info["data"]["list"][0]["dn"]
+        return self.list_stations()[0]
+
+    def list_stations(self):
+        if self.station_id is not None:
+            return [self.station_id]
+
+        stations = []
+        page_size = 100
+        for page in itertools.count(1):
+            station_info = self.call_api(
+                "rest/pvms/web/station/v1/station/station-list",
+                method="post",
+                params={
+                    "curPage": page,
+                    "pageSize": page_size,
+                    "gridConnectedTime": "",
+                    "queryTime": 1666044000000,
+                    "timeZone": 2,
+                    "sortId": "createTime",
+                    "sortDir": "DESC",
+                    "locale": "en_US",
+                },
+            )
+            logging.debug("Station info: %s", station_info["data"])
+            stations.extend(station["dn"] for station in station_info["data"]["list"])
+            if len(station_info["data"]["list"]) < page_size:
+                return stations
 
-    def list_devices(self):
+    def list_devices(self, station=None):
         devices = self.call_api(
             "rest/neteco/web/config/device/v1/device-list",
-            params={
-                "conditionParams.parentDn": self.station_id or self.get_station_id()
-            },
+            params={"conditionParams.parentDn": station or self.get_station_id()},
         )["data"]
         logging.debug("Devices: %s", devices)
         return [dev["dn"] for dev in devices if dev["mocTypeName"] == "Inverter"]
 
+    def list_all_devices(self):
+        """Returns (station, device) pairs for inverters of all stations"""
+        return [
+            (station, device)
+            for station in self.list_stations()
+            for device in self.list_devices(station)
+        ]
+
     def get_available_signals(self, device):
         data = self.call_api(
             "rest/pvms/web/device/v1/device-statistics-signal",
@@ -249,46 +525,149 @@ class FusionSolar:
             ]
         )
 
-    def query(self, device, date, signals):
-        merged_data = {}
-        for unit, subset in signals.split_by_unit().items():
-            single_unit_data = self.query_single_unit_since_ts(device, date, subset)
-            for ts, values in single_unit_data.items():
-                if ts not in merged_data:
-                    merged_data[ts] = dict()
-                merged_data[ts].update(values)
-
-        for ts in merged_data.keys():
-            for signal in signals.signals:
-                if signal.get_code() not in merged_data[ts]:
-                    merged_data[ts][signal.get_code()] = None
+    def group_signals(self, device, date, signals):
+        """Splits signals into sets queried in one request each.
+
+        All signals go in one request if FusionSolar returns mixed units at
+        once, that's probed on the first query, with no retries: any reply
+        other than data of all signals means it doesn't. Otherwise they're
+        grouped by unit. Returns the sets and data of the first day if the
+        probe got it, None otherwise.
+        """
+        by_unit = list(signals.split_by_unit().values())
+        if len(by_unit) == 1:
+            return by_unit, None
+        first_day = None
+        # other queries wait for the probe, it's done once
+        with self.lock:
+            if self.mixed_units is None:
+                try:
+                    first_day = self.query_single_unit(
+                        device, date.timestamp(), signals, retry=False
+                    )
+                    self.mixed_units = True
+                except (KeyError, FusionSolarException):
+                    self.mixed_units = False
+                logging.info(
+                    "FusionSolar %s signals of mixed units in one request",
+                    "accepts" if self.mixed_units else "doesn't accept",
+                )
+            mixed_units = self.mixed_units
+        return ([signals] if mixed_units else by_unit), first_day
 
-        return [
-            Stats(ts=datetime.fromtimestamp(ts, tz=self.timezone), values=values)
-            for ts, values in merged_data.items()
+    def query(self, device, date, signals):
+        units, first_day = self.group_signals(device, date, signals)
+        logging.info(
+            "Querying %d signals of %s in %d requests per day",
+            len(signals.signals),
+            device,
+            len(units),
+        )
+        days = [date.timestamp(), date.timestamp() + 24 * 3600]
+        # a probe of mixed units fetched the first day of the only set already
+        probed = [first_day] if first_day is not None else []
+        # all units and both days are fetched concurrently, results are merged
+        # in submission order so the outcome doesn't depend on timing
+        futures = [
+            [
+                self.executor.submit(self.query_single_unit, device, ts, subset)
+                for ts in days[len(probed) :]
+            ]
+            for subset in units
+        ]
+        units_data = [
+            merge_columns(
+                probed + [future.result() for future in unit_futures],
+                subset.get_codes(),
+            )
+            for subset, unit_futures in zip(units, futures)
         ]
 
-    def query_single_unit_since_ts(self, device, date, signals):
-        base = {
-            **self.query_single_unit(device, date.timestamp(), signals),
-            **self.query_single_unit(device, date.timestamp() + 24 * 3600, signals),
+        gap_futures = {
+            i: self.executor.submit(
+                self.query_single_unit_after_gap,
+                device,
+                date.timestamp() + 2 * 24 * 3600,
+                units[i],
+            )
+            for i, (timestamps, _) in enumerate(units_data)
+            if len(timestamps) == 0
         }
-        next_starting_ts = date.timestamp() + 2 * 24 * 3600
-        while len(base) == 0 and next_starting_ts < time.time():
-            base = {**base, **self.query_single_unit(device, next_starting_ts, signals)}
-            next_starting_ts += 24 * 3600
+        for i, future in gap_futures.items():
+            units_data[i] = future.result()
 
-        return base
+        timestamps, columns = merge_columns(units_data, signals.get_codes())
+        return StatsBatch(
+            device, self.timezone, timestamps, list(columns), list(columns.values())
+        )
 
-    def query_single_unit(self, device, timestamp, signals):
-        data = self.call_api(
-            "rest/pvms/web/device/v1/device-history-data",
-            params={
-                "signalIds": signals.get_ids(),
-                "deviceDn": device,
-                "date": int(timestamp * 1000),
-            },
+    def query_single_unit_after_gap(self, device, starting_ts, signals):
+        """Finds the first day with data after a gap in history.
+
+        Days are probed at doubling distances until one has data, then the first
+        day with data is bisected between it and the last empty probe. Probes of
+        past days are served by the history cache on later cycles.
+        """
+        empty = (array("d"), dict.fromkeys(signals.get_codes(), []))
+        last_day = math.ceil((time.time() - starting_ts) / (24 * 3600)) - 1
+        if last_day < 0:
+            return empty
+
+        def probe(day):
+            return self.query_single_unit(
+                device, starting_ts + day * 24 * 3600, signals
+            )
+
+        low, day = -1, 0  # low: last day known to be empty
+        while True:
+            day = min(day, last_day)
+            data = probe(day)
+            if len(data[0]) > 0:
+                break
+            if day == last_day:
+                return empty
+            low, day = day, 2 * day + 1
+
+        high = day
+        while high - low > 1:
+            middle = (low + high) // 2
+            middle_data = probe(middle)
+            if len(middle_data[0]) > 0:
+                high, data = middle, middle_data
+            else:
+                low = middle
+        logging.info("Skipped %d days of gap in history of %s", high, device)
+        return data
+
+    def is_day_over(self, day):
+        """Tells if history of the day is complete, with a margin for late data"""
+        next_midnight = self.timezone.localize(
+            datetime.combine(day + timedelta(days=1), datetime.min.time())
         )
+        return datetime.now(self.timezone) - next_midnight > timedelta(hours=1)
+
+    def query_single_unit(self, device, timestamp, signals, retry=True):
+        data, day = None, None
+        if self.history_cache is not None:
+            day = datetime.fromtimestamp(timestamp, tz=self.timezone).date()
+            if self.is_day_over(day):
+                data = self.history_cache.get(device, signals.get_ids(), day)
+            else:
+                day = None
+
+        cached = data is not None
+        if not cached:
+            with self.lock:
+                self.history_calls += 1
+            call_api = self.call_api if retry else self.call_api_once
+            data = call_api(
+                "rest/pvms/web/device/v1/device-history-data",
+                params={
+                    "signalIds": signals.get_ids(),
+                    "deviceDn": device,
+                    "date": int(timestamp * 1000),
+                },
+            )
         logging.debug(
             "Single unit data for device %s, timestamp %s and signals %s: %s",
             device,
@@ -296,12 +675,20 @@ class FusionSolar:
             signals,
             data,
         )
-        merged = defaultdict(dict)
+        parts = []
         for signal in signals.signals:
-            for sample in data["data"][str(signal.id)]["pmDataList"]:
-                if "dnId" not in sample:
-                    continue
-                merged[sample["startTime"]].update(
-                    {signal.get_code(): sample["counterValue"]}
+            samples = [
+                sample
+                for sample in data["data"][str(signal.id)]["pmDataList"]
+                if "dnId" in sample
+            ]
+            parts.append(
+                (
+                    array("d", [sample["startTime"] for sample in samples]),
+                    {signal.get_code(): [sample["counterValue"] for sample in samples]},
                 )
-        return merged
+            )
+        # only replies with data of all signals are cached, not errors
+        if not cached and day is not None:
+            self.history_cache.put(device, signals.get_ids(), day, data)
+        return merge_columns(parts, signals.get_codes())
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+
+class HistoryCache:
+    """LRU cache of FusionSolar history responses, bounded by their JSON size.
+
+    Only meant for days which are over, their history doesn't change anymore.
+    With a directory, responses are kept in files there and survive restarts,
+    otherwise they are kept in memory.
+    """
+
+    def __init__(self, directory=None, max_bytes=32 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # name -> (size, response or None if on disk)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        if directory is None:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        files = [name for name in os.listdir(directory) if name.endswith(".json")]
+        files.sort(key=lambda name: os.path.getmtime(self.path(name[:-5])))
+        for name in files:
+            size = os.path.getsize(self.path(name[:-5]))
+            self.entries[name[:-5]] = (size, None)
+            self.size += size
+        self.evict()
+        logging.info(
+            f"History cache in {directory}: {len(self.entries)} days, {self.size} bytes"
+        )
+
+    @staticmethod
+    def name(device, signal_ids, day):
+        key = f"{device}|{','.join(map(str, sorted(signal_ids)))}|{day.isoformat()}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def get(self, device, signal_ids, day):
+        name = self.name(device, signal_ids, day)
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(name)
+        response = entry[1]
+        if response is None:
+            try:
+                with open(self.path(name)) as cached:
+                    response = json.load(cached)
+                os.utime(self.path(name))  # keeps LRU order after restart
+            except FileNotFoundError:  # evicted meanwhile
+                return None
+        return response
+
+    def put(self, device, signal_ids, day, response):
+        name = self.name(device, signal_ids, day)
+        serialized = json.dumps(response)
+        with self.lock:
+            if self.directory is not None:
+                tmp = f"{self.path(name)}.tmp"
+                with open(tmp, "w") as cached:
+                    cached.write(serialized)
+                os.replace(tmp, self.path(name))
+                response = None
+            if name in self.entries:
+                self.size -= self.entries.pop(name)[0]
+            self.entries[name] = (len(serialized), response)
+            self.size += len(serialized)
+            self.evict()
+
+    def evict(self):
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            name, (size, _) = self.entries.popitem(last=False)
+            self.size -= size
+            if self.directory is not None:
+                os.remove(self.path(name))
@@ -45,14 +45,28 @@ class Status:
         )
 
 
+def map_system_ids(system_ids, devices):
+    """Maps DN=ID system ids to devices, a bare ID is taken by the only device"""
+    mapping = dict(
+        system_id.rsplit("=", 1) if "=" in system_id else (None, system_id)
+        for system_id in system_ids
+    )
+    if None in mapping and len(devices) == 1:
+        mapping[devices[0]] = mapping.pop(None)
+    return mapping
+
+
 class PVOutput(Output):
     def __init__(self, system_id, api_key, timezone):
         self.system_id = system_id
         self.api_key = api_key
         self.timezone = timezone
 
+    # a few quick retries only, the output worker retries the whole batch
     @backoff.on_exception(
-        backoff.expo, (requests.exceptions.RequestException, PVOutputException)
+        backoff.expo,
+        (requests.exceptions.RequestException, PVOutputException),
+        max_tries=3,
     )
     def call_api(self, endpoint, params={}):
         url = f"https://pvoutput.org/service/r2/{endpoint}.jsp"
@@ -63,6 +77,7 @@ class PVOutput(Output):
                 "X-Pvoutput-SystemId": str(self.system_id),
             },
             params=params,
+            timeout=60,
         )
         if response.status_code == 400:
             raise PVOutputBadRequestException(response.text)
@@ -0,0 +1,44 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+
+class Checkpoints:
+    """Last timestamp successfully saved to each output, per device.
+
+    Kept in a JSON file, rewritten atomically after every update, so a crash
+    leaves either the previous or the new version. Without a path they are
+    kept in memory only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.checkpoints = {}
+        if path is None:
+            return
+        try:
+            with open(path) as checkpoints:
+                self.checkpoints = json.load(checkpoints)
+        except FileNotFoundError:
+            pass
+        logging.info(f"Loaded checkpoints from {path}: {self.checkpoints}")
+
+    def get(self, device, output):
+        with self.lock:
+            ts = self.checkpoints.get(device, {}).get(output)
+        return datetime.fromisoformat(ts) if ts is not None else None
+
+    def set(self, device, output, ts):
+        with self.lock:
+            self.checkpoints.setdefault(device, {})[output] = ts.isoformat()
+            if self.path is None:
+                return
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as checkpoints:
+                json.dump(self.checkpoints, checkpoints, indent=2)
+                checkpoints.flush()
+                os.fsync(checkpoints.fileno())
+            os.replace(tmp, self.path)
@@ -1,26 +1,61 @@
+import logging
+import threading
+
 from influxdb_client import InfluxDBClient, Point
+from influxdb_client.client.write_api import SYNCHRONOUS
 
 from model import Output
 
 
 class InfluxDB(Output):
-    def __init__(self, uri):
+    def __init__(self, uri, batch_size=5000):
         self.uri = uri
         self.bucket = "pv/infinity"
+        self.batch_size = batch_size
         self.api = None
+        self.lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
 
     def ensure_initialized(self):
-        if self.api is not None:
-            return
+        with self.lock:
+            if self.api is not None:
+                return
 
-        client = InfluxDBClient(url=self.uri, org="-", token="-")
-        self.api = client.write_api()
+            client = InfluxDBClient(url=self.uri, org="-", token="-")
+            # synchronous writes: nothing is buffered, save returns once stored
+            self.api = client.write_api(write_options=SYNCHRONOUS)
 
     def save(self, data):
         self.ensure_initialized()
 
-        for row in data:
-            point = Point.from_dict(
-                {"measurement": "inverter", "fields": row.values, "time": row.ts}
+        points = [
+            Point.from_dict(
+                {
+                    "measurement": "inverter",
+                    "tags": {"device": data.device},
+                    "fields": row.values,
+                    "time": row.ts,
+                }
             )
-            self.api.write(bucket=self.bucket, record=point)
+            for row in data
+        ]
+        for i in range(0, len(points), self.batch_size):
+            chunk = points[i : i + self.batch_size]
+            try:
+                self.api.write(bucket=self.bucket, record=chunk)
+            except Exception:
+                with self.lock:
+                    self.failed += len(points) - i
+                logging.error(
+                    f"InfluxDB write failed, {self.written} points written so far, "
+                    f"{self.failed} failed"
+                )
+                raise
+            with self.lock:
+                self.written += len(chunk)
+        logging.info(
+            f"Wrote {len(points)} points to InfluxDB in "
+            f"{-(-len(points) // self.batch_size)} requests, "
+            f"{self.written} written, {self.failed} failed in total"
+        )
@@ -1,3 +1,8 @@
+import csv
+import io
+import itertools
+import threading
+
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import execute_batch
@@ -6,10 +11,13 @@ from model import Output
 
 
 class PostgreSQL(Output):
-    def __init__(self, url, signals):
+    def __init__(self, url, signals, copy_threshold=288):
         self.url = url
         self.signals = signals
+        # smaller batches are inserted row by row, staging table isn't worth it
+        self.copy_threshold = copy_threshold
         self.conn = None
+        self.lock = threading.Lock()
 
     def ensure_initialized(self):
         if self.conn is not None:
@@ -21,30 +29,88 @@ class PostgreSQL(Output):
         cur.execute(
             f"""
         CREATE TABLE IF NOT EXISTS pv (
-            ts timestamp without time zone primary key,
+            ts timestamp without time zone,
             ts_local timestamp without time zone,
-            {','.join(fields)}
+            device text not null default '',
+            {','.join(fields)},
+            primary key(ts, device)
         )"""
         )
+        # tables created before multi-inverter support: rows without device
+        # keep an empty one, primary key has to include the device
+        cur.execute(
+            "ALTER TABLE pv ADD COLUMN IF NOT EXISTS device text not null default ''"
+        )
+        for field in fields:
+            cur.execute(f"ALTER TABLE pv ADD COLUMN IF NOT EXISTS {field}")
+        cur.execute(
+            """
+        SELECT count(*) FROM information_schema.key_column_usage
+        WHERE table_name = 'pv' AND constraint_name = 'pv_pkey'"""
+        )
+        if cur.fetchone()[0] == 1:
+            cur.execute(
+                "ALTER TABLE pv DROP CONSTRAINT pv_pkey, ADD PRIMARY KEY (ts, device)"
+            )
         self.conn.commit()
 
     def save(self, data):
-        self.ensure_initialized()
-        cur = self.conn.cursor()
-        columns = ["ts", "ts_local"] + self.signals.get_codes()
+        with self.lock:
+            self.ensure_initialized()
+            codes = self.signals.get_codes()
+            columns = ["ts", "ts_local", "device"] + [code.lower() for code in codes]
+            times = data.times()
+            rows = list(
+                zip(
+                    times,
+                    [ts.replace(tzinfo=None) for ts in times],
+                    itertools.repeat(data.device or ""),
+                    *(data.column(code) for code in codes),
+                )
+            )
+            cur = self.conn.cursor()
+            try:
+                if len(rows) >= self.copy_threshold:
+                    self.copy(cur, columns, rows)
+                else:
+                    self.insert(cur, columns, rows)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def insert(self, cur, columns, rows):
         insert = sql.SQL(
             "INSERT INTO pv({}) VALUES ({}) ON CONFLICT DO NOTHING"
         ).format(
-            sql.SQL(", ").join(map(sql.Identifier, [c.lower() for c in columns])),
-            sql.SQL(", ").join(map(sql.Placeholder, columns)),
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.SQL(", ").join(sql.Placeholder() * len(columns)),
         )
+        execute_batch(cur, insert, rows)
 
-        execute_batch(
-            cur,
-            insert,
-            [
-                {**row.values, "ts": row.ts, "ts_local": row.ts.replace(tzinfo=None)}
-                for row in data
-            ],
+    def copy(self, cur, columns, rows):
+        """Streams rows into a staging table, then merges them into pv at once"""
+        fields = [f"{code} decimal(10, 3)" for code in self.signals.get_codes()]
+        # ts stays timestamptz here, so it's converted to timestamp by the same
+        # rules as parameters of the row-by-row insert
+        cur.execute(
+            f"""
+        CREATE TEMP TABLE pv_staging (
+            ts timestamp with time zone,
+            ts_local timestamp without time zone,
+            device text,
+            {','.join(fields)}
+        ) ON COMMIT DROP"""
+        )
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cur.copy_expert(
+            f"COPY pv_staging ({', '.join(columns)}) FROM STDIN "
+            "WITH (FORMAT csv, FORCE_NOT_NULL (device))",
+            buffer,
+        )
+        cur.execute(
+            f"INSERT INTO pv ({', '.join(columns)}) "
+            f"SELECT {', '.join(columns)} FROM pv_staging ON CONFLICT DO NOTHING"
         )
-        self.conn.commit()
@@ -0,0 +1,129 @@
+import logging
+import queue
+import threading
+from datetime import datetime
+
+import backoff
+
+
+class OutputWorker(threading.Thread):
+    """Saves data of one device to one output, in its own thread.
+
+    Batches wait in a bounded queue, so a slow or retrying output doesn't hold
+    up the others nor the FusionSolar polling. When the queue is full a batch
+    is dropped and, as the queued cursor doesn't move, submitted again next
+    cycle. When saving fails for good, the worker rewinds to the last saved
+    timestamp and discards batches queued after the failed one.
+    """
+
+    def __init__(
+        self,
+        device,
+        name,
+        output,
+        checkpoints,
+        starting_ts,
+        queue_size=16,
+        max_tries=5,
+    ):
+        super().__init__(name=f"{name}-{device}", daemon=True)
+        self.device = device
+        self.output_name = name
+        self.checkpoints = checkpoints
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.saved_ts = starting_ts
+        self.queued_ts = starting_ts
+        self.generation = 0
+        self.saved = 0
+        self.failed = 0
+        self.dropped = 0
+        self.save_with_retries = backoff.on_exception(
+            backoff.expo, Exception, max_tries=max_tries, max_value=60
+        )(output.save)
+
+    def submit(self, data):
+        """Queues rows of a StatsBatch newer than already queued ones.
+
+        Returns their number.
+        """
+        with self.lock:
+            rows = data.since(self.queued_ts)
+            if len(rows) == 0:
+                return 0
+            try:
+                self.queue.put_nowait((self.generation, rows))
+            except queue.Full:
+                self.dropped += len(rows)
+                logging.warning(
+                    f"Queue of {self.name} is full, dropping {len(rows)} records"
+                )
+                return 0
+            self.queued_ts = rows[-1].ts
+            return len(rows)
+
+    def run(self):
+        while True:
+            generation, rows = self.queue.get()
+            try:
+                self.save(generation, rows)
+            finally:
+                self.queue.task_done()
+
+    def save(self, generation, rows):
+        with self.lock:
+            if generation != self.generation:
+                return
+        try:
+            self.save_with_retries(rows)
+        except Exception:
+            logging.exception(f"Saving {len(rows)} records to {self.name} failed")
+            with self.lock:
+                self.failed += len(rows)
+                self.generation += 1
+                self.queued_ts = self.saved_ts
+            return
+
+        with self.lock:
+            self.saved += len(rows)
+            self.saved_ts = rows[-1].ts
+        self.checkpoints.set(self.device, self.output_name, self.saved_ts)
+
+    def lag(self):
+        """Time between now and the last saved record"""
+        return datetime.now(self.saved_ts.tzinfo) - self.saved_ts
+
+    def log_stats(self):
+        logging.info(
+            f"{self.name}: {self.queue.qsize()} batches queued, {self.lag()} behind, "
+            f"saved {self.saved}, failed {self.failed}, dropped {self.dropped} records"
+        )
+
+
+def sync_outputs(workers, query, timezone):
+    """Queues new data to output workers of one device, returns newest ts.
+
+    query(starting_ts) returns a StatsBatch of the day of starting_ts and on.
+    Workers at different days are queried for separately, so an output
+    rewound far behind doesn't hold up the ones which are up to date.
+    """
+    by_day = {}
+    for worker in workers:
+        day = worker.queued_ts.astimezone(timezone).date()
+        by_day.setdefault(day, []).append(worker)
+    newest = None
+    for _, day_workers in sorted(by_day.items()):
+        data = query(min(worker.queued_ts for worker in day_workers))
+        for worker in day_workers:
+            queued = worker.submit(data)
+            if queued == 0:
+                logging.info(
+                    f"No data of {worker.device} to update in {worker.output_name}"
+                )
+            else:
+                logging.info(
+                    f"Queued {queued} records of {worker.device} to {worker.output_name}"
+                )
+        if len(data) > 0 and (newest is None or data[-1].ts > newest):
+            newest = data[-1].ts
+    return newest
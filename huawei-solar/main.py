@@ -1,12 +1,18 @@
 import argparse
 import logging
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import pytz
 
-from api.fusionsolar import FusionSolar
-from api.pvoutput import PVOutput
+from api.fusionsolar import FusionSolar, SignalSet
+from api.history_cache import HistoryCache
+from api.pvoutput import PVOutput, map_system_ids
+from checkpoints import Checkpoints
+from dispatcher import OutputWorker, sync_outputs
+from scheduler import Scheduler
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--timezone", default="Europe/Warsaw")
@@ -18,10 +24,89 @@ parser.add_argument(
     help="Fixed station id, use if the app can't discover it automatically. Format: NE=01234567",
 )
 parser.add_argument("--fusionsolar-region", required=True)
+parser.add_argument(
+    "--fusionsolar-concurrency",
+    type=int,
+    default=4,
+    help="Max number of FusionSolar history requests running at once",
+)
+parser.add_argument(
+    "--fusionsolar-pool-size",
+    type=int,
+    help="Max number of keep-alive connections to FusionSolar, defaults to concurrency",
+)
+parser.add_argument(
+    "--fusionsolar-retries",
+    type=int,
+    default=3,
+    help="Retries of a FusionSolar call on connection errors and 502/503/504",
+)
+parser.add_argument(
+    "--fusionsolar-session-cache",
+    required=False,
+    help="File to keep FusionSolar session in between runs, so login is skipped when it's still valid",
+)
+parser.add_argument(
+    "--fusionsolar-session-max-age",
+    type=float,
+    default=12,
+    help="Hours after which cached session is not reused",
+)
+parser.add_argument(
+    "--fusionsolar-cache-dir",
+    required=False,
+    help="Directory to keep history of past days in between runs, in memory if not given",
+)
+parser.add_argument(
+    "--fusionsolar-cache-size",
+    type=int,
+    default=32,
+    help="Max size of cached FusionSolar history, in MB",
+)
 parser.add_argument("--pvoutput-api-key", required=True)
-parser.add_argument("--pvoutput-system-id", required=True)
+parser.add_argument(
+    "--pvoutput-system-id",
+    required=True,
+    action="append",
+    help="PVOutput system id, with several inverters give one per inverter: DN=ID (can be repeated)",
+)
+parser.add_argument(
+    "--checkpoint-file",
+    required=False,
+    help="File keeping the last timestamp saved to each output, to resume from it exactly",
+)
+parser.add_argument(
+    "--output-queue-size",
+    type=int,
+    default=16,
+    help="Max number of batches waiting for each output, more are dropped and retried next cycle",
+)
+parser.add_argument(
+    "--output-max-tries",
+    type=int,
+    default=5,
+    help="Attempts to save a batch before the output rewinds to its last saved record",
+)
 parser.add_argument("--postgres-url", required=False)
+parser.add_argument(
+    "--postgres-copy-threshold",
+    type=int,
+    default=288,
+    help="Batches of at least this many rows (a day of samples by default) are loaded to PostgreSQL with COPY",
+)
 parser.add_argument("--influxdb-url", required=False)
+parser.add_argument(
+    "--influxdb-batch-size",
+    type=int,
+    default=5000,
+    help="Max number of points written to InfluxDB in one request",
+)
+parser.add_argument(
+    "--latitude",
+    type=float,
+    help="Location of PV system, to skip polling between sunset and sunrise",
+)
+parser.add_argument("--longitude", type=float)
 parser.add_argument("--verbose", help="increase output verbosity", action="store_true")
 parser.add_argument(
     "--start-date",
@@ -40,52 +125,143 @@ fusionsolar = FusionSolar(
     timezone,
     region=args.fusionsolar_region,
     station_id=args.fusionsolar_station_id,
+    max_workers=args.fusionsolar_concurrency,
+    pool_size=args.fusionsolar_pool_size,
+    retries=args.fusionsolar_retries,
+    session_cache=args.fusionsolar_session_cache,
+    session_max_age=timedelta(hours=args.fusionsolar_session_max_age),
+    history_cache=HistoryCache(
+        args.fusionsolar_cache_dir, args.fusionsolar_cache_size * 1024 * 1024
+    ),
 )
-devices = fusionsolar.list_devices()
-assert (
-    len(devices) == 1
-), "Multiple inverters found, select a device you want to synchronize"
-device = devices[0]
-signals = fusionsolar.get_available_signals(device)
-logging.info("Available signals: %s", signals)
-pvoutput = PVOutput(args.pvoutput_system_id, args.pvoutput_api_key, timezone)
-outputs = [("PVOutput", pvoutput)]
+devices = fusionsolar.list_all_devices()
+logging.info("Found inverters: %s", devices)
+if not devices:
+    sys.exit("No inverters found in FusionSolar, check --fusionsolar-station-id")
+signals = {}
+for station, device in devices:
+    signals[device] = fusionsolar.get_available_signals(device)
+    logging.info(
+        "Available signals of %s (station %s): %s", device, station, signals[device]
+    )
+
+pvoutput_system_ids = map_system_ids(
+    args.pvoutput_system_id, [device for _, device in devices]
+)
+outputs = {device: [] for _, device in devices}
+for _, device in devices:
+    if device in pvoutput_system_ids:
+        pvoutput = PVOutput(
+            pvoutput_system_ids[device], args.pvoutput_api_key, timezone
+        )
+        outputs[device].append(("PVOutput", pvoutput))
+    else:
+        logging.warning(
+            f"No PVOutput system id for {device}, use --pvoutput-system-id DN=ID"
+        )
 if args.postgres_url is not None:
     from db.postgres import PostgreSQL
 
-    outputs.insert(0, ("PostgreSQL", PostgreSQL(args.postgres_url, signals)))
+    all_signals = SignalSet.union(signals.values())
+    postgres = PostgreSQL(
+        args.postgres_url, all_signals, copy_threshold=args.postgres_copy_threshold
+    )
+    for device_outputs in outputs.values():
+        device_outputs.insert(0, ("PostgreSQL", postgres))
 if args.influxdb_url is not None:
     from db.influxdb import InfluxDB
 
-    outputs.insert(0, ("InfluxDB", InfluxDB(args.influxdb_url)))
+    influxdb = InfluxDB(args.influxdb_url, batch_size=args.influxdb_batch_size)
+    for device_outputs in outputs.values():
+        device_outputs.insert(0, ("InfluxDB", influxdb))
+
 
-last_pushed_ts = pvoutput.get_last_pushed_timestamp()
-logging.info(f"Last data transfer to PV Output: {last_pushed_ts}")
-if last_pushed_ts is not None:
-    starting_ts = last_pushed_ts
-elif args.start_date is None:
-    starting_ts = (datetime.now(timezone) - timedelta(days=12)).replace(
+def get_starting_ts(device):
+    pvoutput = dict(outputs[device]).get("PVOutput")
+    last_pushed_ts = None
+    if pvoutput is not None:
+        last_pushed_ts = pvoutput.get_last_pushed_timestamp()
+        logging.info(f"Last data transfer of {device} to PV Output: {last_pushed_ts}")
+    if last_pushed_ts is not None:
+        return last_pushed_ts
+
+    earliest_ts = (datetime.now(timezone) - timedelta(days=12)).replace(
         hour=0, minute=0, second=0, microsecond=0
     )
-    logging.info(f"Starting at earlist possible date, 12 days ago: {starting_ts}")
-else:
+    if args.start_date is None:
+        logging.info(f"Starting at earlist possible date, 12 days ago: {earliest_ts}")
+        return earliest_ts
+
     starting_ts = timezone.localize(datetime.strptime(args.start_date, "%Y-%m-%d"))
     if (timezone.localize(datetime.now()) - starting_ts).days < 14:
         logging.info(f"Starting with PV connection date: {starting_ts}")
-    else:
-        starting_ts = (datetime.now(timezone) - timedelta(days=12)).replace(
-            hour=0, minute=0, second=0, microsecond=0
+        return starting_ts
+    logging.info(f"Starting at earlist possible date, 12 days ago: {earliest_ts}")
+    return earliest_ts
+
+
+def resume(device):
+    """Starts output workers of a device at their checkpoints, if present"""
+    cursors = {name: checkpoints.get(device, name) for name, _ in outputs[device]}
+    if None in cursors.values():
+        starting_ts = get_starting_ts(device)
+        cursors = {name: ts or starting_ts for name, ts in cursors.items()}
+    logging.info(f"Resuming {device} from {cursors}")
+    device_workers = [
+        OutputWorker(
+            device,
+            name,
+            output,
+            checkpoints,
+            cursors[name],
+            queue_size=args.output_queue_size,
+            max_tries=args.output_max_tries,
         )
-        logging.info(f"Starting at earlist possible date, 12 days ago: {starting_ts}")
+        for name, output in outputs[device]
+    ]
+    for worker in device_workers:
+        worker.start()
+    return device_workers
+
 
+def sync(device):
+    """Queues new data of a device to each of its outputs, returns newest ts"""
+    return sync_outputs(
+        workers[device],
+        lambda starting_ts: fusionsolar.query(device, starting_ts, signals[device]),
+        timezone,
+    )
+
+
+checkpoints = Checkpoints(args.checkpoint_file)
+synced_devices = [
+    device for device, device_outputs in outputs.items() if device_outputs
+]
+executor = ThreadPoolExecutor(max_workers=len(devices))
+workers = dict(zip(synced_devices, executor.map(resume, synced_devices)))
+scheduler = Scheduler(latitude=args.latitude, longitude=args.longitude)
 while True:
-    data = fusionsolar.query(device, starting_ts, signals)
-    data_to_push = [row for row in data if row.ts > starting_ts]
-    if len(data_to_push) > 0:
-        for output in outputs:
-            logging.info(f"Pushing {len(data_to_push)} records to {output[0]}")
-            output[1].save(data_to_push)
-        starting_ts = data_to_push[-1].ts
-    else:
-        logging.info("No data to update")
-    time.sleep(5 * 60)
+    futures = {device: executor.submit(sync, device) for device in workers}
+    newest = []
+    for device, future in futures.items():
+        try:
+            device_newest = future.result()
+            if device_newest is not None:
+                newest.append(device_newest)
+        except Exception:
+            logging.exception(
+                f"Synchronization of {device} failed, retrying next cycle"
+            )
+    logging.info(
+        f"FusionSolar history: {fusionsolar.history_calls} requests, "
+        f"{fusionsolar.history_cache.hits} cache hits, "
+        f"{fusionsolar.history_cache.misses} misses"
+    )
+    for device_workers in workers.values():
+        for worker in device_workers:
+            worker.log_stats()
+    next_poll = scheduler.next_poll(max(newest, default=None))
+    logging.info(
+        f"Next poll at {next_poll.astimezone(timezone)}, publish lag {scheduler.lag}"
+    )
+    time.sleep(max(0, (next_poll - datetime.now(pytz.utc)).total_seconds()))
@@ -1,4 +1,8 @@
 class Output:
     def save(self, data):
-        """Saves data batch to Output system"""
+        """Saves data batch to Output system.
+
+        data is a StatsBatch of one device, its rows are StatsRow views of
+        the columns, which can be read directly too with data.column(code).
+        """
         pass
@@ -0,0 +1,122 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+JULIAN_UNIX_EPOCH = 2440587.5
+J2000 = 2451545.0
+
+
+def sun_times(day, latitude, longitude):
+    """Returns sunrise and sunset (UTC) of a day, by the sunrise equation.
+
+    There's no night in polar day, sunrise and sunset are 12h from noon then,
+    and in polar night both are at noon.
+    """
+    noon = datetime(day.year, day.month, day.day, 12, tzinfo=timezone.utc)
+    n = round(noon.timestamp() / 86400 + JULIAN_UNIX_EPOCH - J2000)
+    mean_solar_time = n - longitude / 360
+    anomaly = math.radians((357.5291 + 0.98560028 * mean_solar_time) % 360)
+    center = (
+        1.9148 * math.sin(anomaly)
+        + 0.02 * math.sin(2 * anomaly)
+        + 0.0003 * math.sin(3 * anomaly)
+    )
+    ecliptic_longitude = math.radians(
+        (math.degrees(anomaly) + center + 180 + 102.9372) % 360
+    )
+    transit = (
+        J2000
+        + mean_solar_time
+        + 0.0053 * math.sin(anomaly)
+        - 0.0069 * math.sin(2 * ecliptic_longitude)
+    )
+    declination = math.asin(
+        math.sin(ecliptic_longitude) * math.sin(math.radians(23.4397))
+    )
+    cos_hour_angle = (
+        math.sin(math.radians(-0.833))
+        - math.sin(math.radians(latitude)) * math.sin(declination)
+    ) / (math.cos(math.radians(latitude)) * math.cos(declination))
+    hour_angle = math.degrees(math.acos(max(-1, min(1, cos_hour_angle))))
+
+    def to_datetime(julian_day):
+        return datetime.fromtimestamp(
+            (julian_day - JULIAN_UNIX_EPOCH) * 86400, tz=timezone.utc
+        )
+
+    return to_datetime(transit - hour_angle / 360), to_datetime(
+        transit + hour_angle / 360
+    )
+
+
+class Scheduler:
+    """Tells when to poll FusionSolar next.
+
+    Samples come every interval and show up after a publish lag, which is
+    learnt from polls: a poll is planned just after the next sample should be
+    out, retried with growing delays while it's missing, and moved to sunrise
+    when it falls at night (if location is given). Night starts a margin after
+    sunset, so the last samples of a day get in. It's only slept through once
+    samples are caught up to its start, a backlog is fetched at night too.
+    """
+
+    def __init__(
+        self,
+        interval=timedelta(minutes=5),
+        lag=timedelta(minutes=1),
+        retry=timedelta(seconds=30),
+        latitude=None,
+        longitude=None,
+        dusk=timedelta(minutes=30),
+    ):
+        self.interval = interval
+        self.lag = lag
+        self.retry = retry
+        self.latitude = latitude
+        self.longitude = longitude
+        self.dusk = dusk
+        self.newest = None
+        self.misses = 0
+
+    def next_poll(self, newest, now=None):
+        """Plans next poll, given timestamp of the newest sample seen so far"""
+        now = now or datetime.now(timezone.utc)
+        if newest is not None and (self.newest is None or newest > self.newest):
+            if self.newest is not None:
+                if self.misses == 0:
+                    # sample was already there, try a bit earlier next time
+                    lag = self.lag * 0.9
+                else:
+                    lag = now - newest
+                self.lag = max(timedelta(seconds=10), min(lag, self.interval))
+            self.newest = newest
+            self.misses = 0
+            wake = newest + self.interval + self.lag
+        else:
+            wake = now + min(self.retry * 2**self.misses, self.interval)
+            self.misses += 1
+
+        if wake <= now:
+            wake = self.align(now)
+        return self.after_night(wake, now)
+
+    def align(self, now):
+        """First sample boundary plus lag after now"""
+        interval = self.interval.total_seconds()
+        boundary = math.ceil((now - self.lag).timestamp() / interval) * interval
+        return datetime.fromtimestamp(boundary, tz=timezone.utc) + self.lag
+
+    def after_night(self, wake, now):
+        if self.latitude is None or self.longitude is None or self.newest is None:
+            return wake
+        for days in (-1, 0, 1):
+            day = wake.date() + timedelta(days=days)
+            _, sunset = sun_times(day, self.latitude, self.longitude)
+            sunrise, _ = sun_times(
+                day + timedelta(days=1), self.latitude, self.longitude
+            )
+            if sunset + self.dusk <= wake < sunrise:
+                # samples may stop before sunset, the margin counts as lag
+                night = min(now, sunset + self.dusk)
+                if night - self.newest <= self.interval + self.lag + self.dusk:
+                    return sunrise
+        return wake
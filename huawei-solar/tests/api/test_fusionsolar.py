@@ -1,10 +1,14 @@
+import json
+import os
+import tempfile
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import Mock, patch
 
 import pytz
 
 from api.fusionsolar import FusionSolar, Signal, SignalSet
+from api.history_cache import HistoryCache
 
 
 class TestStringMethods(unittest.TestCase):
@@ -14,6 +18,8 @@ class TestStringMethods(unittest.TestCase):
         )
         self.fusionsolar.session = "session"
         self.fusionsolar.api_base = "http://api.dev"
+        self.fusionsolar.csrf = "csrf"
+        self.fusionsolar.csrf_time = datetime.now()
 
     def _create_device_history_data(self, points):
         return {
@@ -31,7 +37,7 @@ class TestStringMethods(unittest.TestCase):
             }
         }
 
-    @patch("api.fusionsolar.requests.get")
+    @patch("api.fusionsolar.requests.Session.get")
     def test_queries_2_days_of_data_in_the_usual_scenario(self, get_mock):
         # given
         timezone = pytz.timezone("Europe/Warsaw")
@@ -51,7 +57,7 @@ class TestStringMethods(unittest.TestCase):
         assert len(data) == 2
         assert len(get_mock.return_value.json.call_args_list) == 2
 
-    @patch("api.fusionsolar.requests.get")
+    @patch("api.fusionsolar.requests.Session.get")
     def test_queries_more_days_in_case_of_data_gap(self, get_mock):
         # given
         timezone = pytz.timezone("Europe/Warsaw")
@@ -73,6 +79,391 @@ class TestStringMethods(unittest.TestCase):
         assert len(data) == 1
         assert len(get_mock.return_value.json.call_args_list) == 4
 
+    def _history_since(self, first_ts, requested_dates):
+        """Device history mock with data of each day since first_ts"""
+
+        def device_history_data(url, params, **kwargs):
+            date = params["date"] / 1000
+            requested_dates.append(date)
+            response = Mock(
+                headers={"Content-Type": "application/json"}, status_code=200
+            )
+            response.json.return_value = self._create_device_history_data(
+                [(date, 0.01)] if date >= first_ts else []
+            )
+            return response
+
+        return device_history_data
+
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_finds_end_of_long_data_gap_in_few_queries(self, get_mock):
+        # given
+        timezone = pytz.timezone("Europe/Warsaw")
+        signals = SignalSet([Signal(id="active_power", name="Active power", unit="kW")])
+        starting_ts = timezone.localize(datetime(2024, 1, 1, 0, 0, 0))
+        first_ts = starting_ts.timestamp() + 40 * 24 * 3600
+        requested_dates = []
+        get_mock.side_effect = self._history_since(first_ts, requested_dates)
+
+        # when
+        data = self.fusionsolar.query(device=None, date=starting_ts, signals=signals)
+
+        # then
+        assert [row.ts.timestamp() for row in data] == [first_ts]
+        assert len(requested_dates) <= 2 + 2 * 7
+        assert min(date for date in requested_dates if date >= first_ts) == first_ts
+
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_reuses_gap_probes_on_next_query(self, get_mock):
+        # given
+        timezone = pytz.timezone("Europe/Warsaw")
+        signals = SignalSet([Signal(id="active_power", name="Active power", unit="kW")])
+        starting_ts = timezone.localize(datetime(2024, 1, 1, 0, 0, 0))
+        first_ts = starting_ts.timestamp() + 100 * 24 * 3600
+        requested_dates = []
+        get_mock.side_effect = self._history_since(first_ts, requested_dates)
+        self.fusionsolar.timezone = timezone
+        self.fusionsolar.history_cache = HistoryCache()
+        self.fusionsolar.query(device="NE=1", date=starting_ts, signals=signals)
+        requests_made = len(requested_dates)
+
+        # when
+        data = self.fusionsolar.query(device="NE=1", date=starting_ts, signals=signals)
+
+        # then
+        assert [row.ts.timestamp() for row in data] == [first_ts]
+        assert len(requested_dates) == requests_made
+
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_stops_gap_search_at_current_day(self, get_mock):
+        # given
+        timezone = pytz.timezone("Europe/Warsaw")
+        signals = SignalSet([Signal(id="active_power", name="Active power", unit="kW")])
+        starting_ts = timezone.localize(datetime(2024, 1, 1, 0, 0, 0))
+        requested_dates = []
+        get_mock.side_effect = self._history_since(float("inf"), requested_dates)
+
+        # when
+        data = self.fusionsolar.query(device=None, date=starting_ts, signals=signals)
+
+        # then
+        assert len(data) == 0
+        assert max(requested_dates) < datetime.now().timestamp()
+        assert len(requested_dates) < 20
+
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_merges_units_queried_concurrently(self, get_mock):
+        # given
+        timezone = pytz.timezone("Europe/Warsaw")
+        self.fusionsolar.timezone = timezone
+        signals = SignalSet(
+            [
+                Signal(id="active_power", name="Active power", unit="kW"),
+                Signal(id="a_u", name="Grid phase A voltage", unit="V"),
+            ]
+        )
+        starting_ts = timezone.localize(datetime(2024, 4, 21, 18, 0, 0))
+        responses = {
+            ("active_power", starting_ts.timestamp()): [(1713718800, 1.0)],
+            ("active_power", starting_ts.timestamp() + 86400): [(1713805200, 2.0)],
+            ("a_u", starting_ts.timestamp()): [(1713718800, 230.0)],
+            ("a_u", starting_ts.timestamp() + 86400): [],
+        }
+
+        def device_history_data(url, params, **kwargs):
+            # mixed units in one request: data of the first one only
+            signal_id = params["signalIds"][0]
+            points = responses[(signal_id, params["date"] / 1000)]
+            response = Mock(
+                headers={"Content-Type": "application/json"}, status_code=200
+            )
+            response.json.return_value = {
+                "data": {
+                    signal_id: {
+                        "pmDataList": [
+                            {"dnId": 100, "counterValue": value, "startTime": ts}
+                            for ts, value in points
+                        ]
+                    }
+                }
+            }
+            return response
+
+        get_mock.side_effect = device_history_data
+
+        # when
+        data = self.fusionsolar.query(device=None, date=starting_ts, signals=signals)
+
+        # then
+        assert [(row.ts.timestamp(), row.values) for row in data] == [
+            (1713718800, {"active_power": 1.0, "a_u": 230.0}),
+            (1713805200, {"active_power": 2.0, "a_u": None}),
+        ]
+        assert self.fusionsolar.mixed_units is False
+        assert get_mock.call_count == 5
+
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_queries_mixed_units_in_one_request(self, get_mock):
+        # given
+        timezone = pytz.timezone("Europe/Warsaw")
+        self.fusionsolar.timezone = timezone
+        signals = SignalSet(
+            [
+                Signal(id="active_power", name="Active power", unit="kW"),
+                Signal(id="a_u", name="Grid phase A voltage", unit="V"),
+            ]
+        )
+        starting_ts = timezone.localize(datetime(2024, 4, 21, 18, 0, 0))
+        get_mock.return_value.headers = {"Content-Type": "application/json"}
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.json.return_value = {
+            "data": {
+                "active_power": {
+                    "pmDataList": [
+                        {"dnId": 100, "counterValue": 1.0, "startTime": 1713718800}
+                    ]
+                },
+                "a_u": {
+                    "pmDataList": [
+                        {"dnId": 100, "counterValue": 230.0, "startTime": 1713718800}
+                    ]
+                },
+            }
+        }
+
+        # when
+        self.fusionsolar.query(device=None, date=starting_ts, signals=signals)
+        data = self.fusionsolar.query(device=None, date=starting_ts, signals=signals)
+
+        # then
+        assert [(row.ts.timestamp(), row.values) for row in data] == [
+            (1713718800, {"active_power": 1.0, "a_u": 230.0}),
+        ]
+        assert self.fusionsolar.mixed_units is True
+        assert get_mock.call_count == 4  # probe as the first day, then 2 days
+        assert all(
+            call.kwargs["params"]["signalIds"] == ["active_power", "a_u"]
+            for call in get_mock.call_args_list
+        )
+
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_groups_by_unit_when_mixed_units_are_refused(self, get_mock):
+        # given
+        timezone = pytz.timezone("Europe/Warsaw")
+        self.fusionsolar.timezone = timezone
+        signals = SignalSet(
+            [
+                Signal(id="active_power", name="Active power", unit="kW"),
+                Signal(id="a_u", name="Grid phase A voltage", unit="V"),
+            ]
+        )
+        starting_ts = timezone.localize(datetime(2024, 4, 21, 18, 0, 0))
+
+        def device_history_data(url, params, **kwargs):
+            signal_ids = params["signalIds"]
+            response = Mock(headers={"Content-Type": "application/json"})
+            response.status_code = 400 if len(signal_ids) > 1 else 200
+            response.json.return_value = {
+                "data": {
+                    signal_ids[0]: {
+                        "pmDataList": [
+                            {"dnId": 100, "counterValue": 1.0, "startTime": 1713718800}
+                        ]
+                    }
+                }
+            }
+            return response
+
+        get_mock.side_effect = device_history_data
+
+        # when
+        data = self.fusionsolar.query(device=None, date=starting_ts, signals=signals)
+
+        # then
+        assert [(row.ts.timestamp(), row.values) for row in data] == [
+            (1713718800, {"active_power": 1.0, "a_u": 1.0}),
+        ]
+        assert self.fusionsolar.mixed_units is False
+        assert get_mock.call_count == 5  # refused probe, then 2 days of 2 units
+
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_serves_past_days_from_history_cache(self, get_mock):
+        # given
+        timezone = pytz.timezone("Europe/Warsaw")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        signals = SignalSet([Signal(id="active_power", name="Active power", unit="kW")])
+        starting_ts = timezone.localize(datetime(2024, 4, 21, 0, 0, 0))
+        get_mock.return_value.headers = {"Content-Type": "application/json"}
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.json.side_effect = [
+            self._create_device_history_data([(1713669300, 0.01)]),
+            self._create_device_history_data([(1713756000, 0.02)]),
+        ]
+        self.fusionsolar.timezone = timezone
+        self.fusionsolar.history_cache = HistoryCache(directory.name)
+        fetched = self.fusionsolar.query(
+            device="NE=1", date=starting_ts, signals=signals
+        )
+
+        # when
+        self.fusionsolar.history_cache = HistoryCache(directory.name)  # restarted
+        data = self.fusionsolar.query(device="NE=1", date=starting_ts, signals=signals)
+
+        # then
+        assert [(row.ts, dict(row.values)) for row in data] == [
+            (row.ts, dict(row.values)) for row in fetched
+        ]
+        assert len(get_mock.return_value.json.call_args_list) == 2
+        assert self.fusionsolar.history_cache.hits == 2
+
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_does_not_cache_reply_without_data(self, get_mock):
+        # given
+        timezone = pytz.timezone("Europe/Warsaw")
+        signals = SignalSet([Signal(id="active_power", name="Active power", unit="kW")])
+        starting_ts = timezone.localize(datetime(2024, 4, 21, 0, 0, 0))
+        get_mock.return_value.headers = {"Content-Type": "application/json"}
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.json.side_effect = [
+            {"failCode": 407},
+            self._create_device_history_data([(1713669300, 0.01)]),
+        ]
+        self.fusionsolar.timezone = timezone
+        self.fusionsolar.history_cache = HistoryCache()
+        with self.assertRaises(KeyError):
+            self.fusionsolar.query_single_unit("NE=1", starting_ts.timestamp(), signals)
+
+        # when
+        timestamps, columns = self.fusionsolar.query_single_unit(
+            "NE=1", starting_ts.timestamp(), signals
+        )
+
+        # then
+        assert list(timestamps) == [1713669300]
+        assert columns == {"active_power": [0.01]}
+        assert len(get_mock.return_value.json.call_args_list) == 2
+        assert len(self.fusionsolar.history_cache.entries) == 1
+
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_fetches_current_day_again(self, get_mock):
+        # given
+        timezone = pytz.timezone("Europe/Warsaw")
+        signals = SignalSet([Signal(id="active_power", name="Active power", unit="kW")])
+        starting_ts = datetime.now(timezone).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        get_mock.return_value.headers = {"Content-Type": "application/json"}
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.json.side_effect = lambda: (
+            self._create_device_history_data([(starting_ts.timestamp(), 0.01)])
+        )
+        self.fusionsolar.timezone = timezone
+        self.fusionsolar.history_cache = HistoryCache()
+
+        # when
+        self.fusionsolar.query(device="NE=1", date=starting_ts, signals=signals)
+        self.fusionsolar.query(device="NE=1", date=starting_ts, signals=signals)
+
+        # then
+        assert len(get_mock.return_value.json.call_args_list) == 4
+        assert self.fusionsolar.history_cache.hits == 0
+
+    def _cached_session(self, login_time):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "session.json")
+        with open(path, "w") as cache:
+            json.dump(
+                {
+                    "username": "user",
+                    "region": "region01",
+                    "session": "cached-session",
+                    "api_base": "http://api.dev",
+                    "station": "NE=1",
+                    "csrf": "old-csrf",
+                    "csrf_time": login_time.isoformat(),
+                    "login_time": login_time.isoformat(),
+                },
+                cache,
+            )
+        return FusionSolar(
+            username="user",
+            password=None,
+            timezone=None,
+            region="region01",
+            session_cache=path,
+        )
+
+    @patch("api.fusionsolar.FusionSolar.login")
+    @patch("api.fusionsolar.requests.Session.get")
+    def test_reuses_cached_session_accepted_by_keep_alive(self, get_mock, login_mock):
+        # given
+        fusionsolar = self._cached_session(datetime.now() - timedelta(hours=1))
+        get_mock.return_value.headers = {"Content-Type": "application/json"}
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.json.side_effect = [{"payload": "new-csrf"}, {"data": []}]
+
+        # when
+        fusionsolar.call_api("endpoint")
+
+        # then
+        login_mock.assert_not_called()
+        assert fusionsolar.session == "cached-session"
+        assert fusionsolar.csrf == "new-csrf"
+        with open(fusionsolar.session_cache) as cache:
+            assert json.load(cache)["csrf"] == "new-csrf"
+
+    @patch("api.fusionsolar.FusionSolar.login")
+    def test_logs_in_when_cached_session_expired(self, login_mock):
+        # given
+        fusionsolar = self._cached_session(datetime.now() - timedelta(days=1))
+
+        # when
+        restored = fusionsolar.restore_session()
+
+        # then
+        assert not restored
+        assert fusionsolar.session is None
+
+    @patch("api.fusionsolar.FusionSolar.call_api")
+    def test_lists_stations_of_all_pages(self, call_api_mock):
+        # given
+        call_api_mock.side_effect = [
+            {"data": {"list": [{"dn": f"NE={i}"} for i in range(100)]}},
+            {"data": {"list": [{"dn": "NE=100"}]}},
+        ]
+
+        # when
+        stations = self.fusionsolar.list_stations()
+
+        # then
+        assert stations == [f"NE={i}" for i in range(101)]
+        pages = [c.kwargs["params"]["curPage"] for c in call_api_mock.call_args_list]
+        assert pages == [1, 2]
+
+    @patch("api.fusionsolar.FusionSolar.call_api")
+    def test_lists_inverters_of_all_stations(self, call_api_mock):
+        # given
+        devices = {
+            "NE=1": [
+                {"dn": "NE=11", "mocTypeName": "Inverter"},
+                {"dn": "NE=12", "mocTypeName": "Dongle"},
+            ],
+            "NE=2": [{"dn": "NE=21", "mocTypeName": "Inverter"}],
+        }
+        call_api_mock.side_effect = lambda endpoint, method="get", params={}: (
+            {"data": {"list": [{"dn": "NE=1"}, {"dn": "NE=2"}]}}
+            if endpoint.endswith("station-list")
+            else {"data": devices[params["conditionParams.parentDn"]]}
+        )
+
+        # when
+        all_devices = self.fusionsolar.list_all_devices()
+
+        # then
+        assert all_devices == [("NE=1", "NE=11"), ("NE=2", "NE=21")]
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+
+from api.pvoutput import map_system_ids
+
+
+class TestMapSystemIds(unittest.TestCase):
+    def test_maps_system_ids_by_device_dn(self):
+        # when
+        mapping = map_system_ids(["NE=1=100", "NE=2=200"], ["NE=1", "NE=2", "NE=3"])
+
+        # then
+        assert mapping == {"NE=1": "100", "NE=2": "200"}
+
+    def test_gives_bare_system_id_to_the_only_device(self):
+        # when
+        mapping = map_system_ids(["100"], ["NE=1"])
+
+        # then
+        assert mapping == {"NE=1": "100"}
+
+    def test_leaves_bare_system_id_unmapped_with_several_devices(self):
+        # when
+        mapping = map_system_ids(["100"], ["NE=1", "NE=2"])
+
+        # then
+        assert "NE=1" not in mapping and "NE=2" not in mapping
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from array import array
+from datetime import datetime
+from unittest.mock import patch
+
+import pytz
+
+from api.fusionsolar import StatsBatch
+from db.influxdb import InfluxDB
+
+
+class TestInfluxDB(unittest.TestCase):
+    @patch("db.influxdb.InfluxDBClient")
+    def test_writes_rows_in_batches(self, client_mock):
+        # given
+        write_mock = client_mock.return_value.write_api.return_value.write
+        start = pytz.utc.localize(datetime(2022, 10, 30))
+        rows = StatsBatch(
+            "NE=1",
+            pytz.utc,
+            array("d", [start.timestamp() + 5 * 60 * i for i in range(12 * 288)]),
+            ["active_power"],
+            [list(range(12 * 288))],
+        )
+        influxdb = InfluxDB("http://influxdb", batch_size=1000)
+
+        # when
+        influxdb.save(rows)
+
+        # then
+        batches = [call.kwargs["record"] for call in write_mock.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [1000, 1000, 1000, 456])
+        self.assertEqual(influxdb.written, len(rows))
+        self.assertEqual(
+            batches[0][1].to_line_protocol(),
+            "inverter,device=NE\\=1 active_power=1i 1667088300000000000",
+        )
+
+    @patch("db.influxdb.InfluxDBClient")
+    def test_counts_points_not_written_when_batch_fails(self, client_mock):
+        # given
+        write_mock = client_mock.return_value.write_api.return_value.write
+        write_mock.side_effect = [None, Exception("timeout")]
+        start = pytz.utc.localize(datetime(2022, 10, 30))
+        rows = StatsBatch(
+            "NE=1",
+            pytz.utc,
+            array("d", [start.timestamp() + 5 * 60 * i for i in range(25)]),
+            ["active_power"],
+            [list(range(25))],
+        )
+        influxdb = InfluxDB("http://influxdb", batch_size=10)
+
+        # when
+        with self.assertRaises(Exception):
+            influxdb.save(rows)
+
+        # then
+        self.assertEqual((influxdb.written, influxdb.failed), (10, 15))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from array import array
+from datetime import datetime
+from unittest.mock import patch
+
+import pytz
+
+from api.fusionsolar import Signal, SignalSet, StatsBatch
+from db.postgres import PostgreSQL
+
+SIGNALS = SignalSet([Signal(id="active_power", name="Active power", unit="kW")])
+
+
+class TestPostgreSQL(unittest.TestCase):
+    def _executed(self, connect_mock):
+        cursor = connect_mock.return_value.cursor.return_value
+        return [" ".join(c.args[0].split()) for c in cursor.execute.call_args_list]
+
+    @patch("db.postgres.psycopg2.connect")
+    def test_adds_device_to_primary_key_of_old_table(self, connect_mock):
+        # given
+        cursor = connect_mock.return_value.cursor.return_value
+        cursor.fetchone.return_value = (1,)  # primary key on ts only
+        postgres = PostgreSQL("postgres://db", SIGNALS)
+
+        # when
+        postgres.ensure_initialized()
+
+        # then
+        executed = self._executed(connect_mock)
+        assert (
+            "ALTER TABLE pv ADD COLUMN IF NOT EXISTS device text not null default ''"
+            in executed
+        )
+        assert (
+            "ALTER TABLE pv DROP CONSTRAINT pv_pkey, ADD PRIMARY KEY (ts, device)"
+            in executed
+        )
+        connect_mock.return_value.commit.assert_called_once()
+
+    @patch("db.postgres.psycopg2.connect")
+    def test_keeps_primary_key_including_device(self, connect_mock):
+        # given
+        cursor = connect_mock.return_value.cursor.return_value
+        cursor.fetchone.return_value = (2,)
+        postgres = PostgreSQL("postgres://db", SIGNALS)
+
+        # when
+        postgres.ensure_initialized()
+
+        # then
+        assert not any("DROP CONSTRAINT" in sql for sql in self._executed(connect_mock))
+
+    @patch("db.postgres.psycopg2.connect")
+    def test_copies_backfill_of_two_days(self, connect_mock):
+        # given
+        start = pytz.utc.localize(datetime(2024, 4, 21))
+        rows = StatsBatch(
+            "NE=1",
+            pytz.utc,
+            array("d", [start.timestamp() + 5 * 60 * i for i in range(2 * 288)]),
+            ["active_power"],
+            [list(range(2 * 288))],
+        )
+        postgres = PostgreSQL("postgres://db", SIGNALS)
+
+        # when
+        postgres.save(rows)
+
+        # then
+        cursor = connect_mock.return_value.cursor.return_value
+        cursor.copy_expert.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
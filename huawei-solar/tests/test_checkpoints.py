@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import pytz
+
+from checkpoints import Checkpoints
+
+
+class TestCheckpoints(unittest.TestCase):
+    def test_resumes_each_output_from_its_own_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # given
+            path = os.path.join(tmp, "checkpoints.json")
+            timezone = pytz.timezone("Europe/Warsaw")
+            pvoutput_ts = timezone.localize(datetime(2022, 10, 30, 2, 30))
+            postgres_ts = timezone.localize(datetime(2022, 10, 29, 12, 0))
+            checkpoints = Checkpoints(path)
+            checkpoints.set("NE=1", "PVOutput", pvoutput_ts)
+            checkpoints.set("NE=1", "PostgreSQL", postgres_ts)
+
+            # when
+            restored = Checkpoints(path)
+
+            # then
+            self.assertEqual(restored.get("NE=1", "PVOutput"), pvoutput_ts)
+            self.assertEqual(restored.get("NE=1", "PostgreSQL"), postgres_ts)
+            self.assertIsNone(restored.get("NE=1", "InfluxDB"))
+            self.assertIsNone(restored.get("NE=2", "PVOutput"))
+            self.assertFalse(os.path.exists(path + ".tmp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+from array import array
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytz
+
+from api.fusionsolar import StatsBatch
+from checkpoints import Checkpoints
+from dispatcher import OutputWorker, sync_outputs
+
+
+class TestOutputWorker(unittest.TestCase):
+    def setUp(self):
+        self.start = pytz.utc.localize(datetime(2022, 10, 30, 12, 0))
+        timestamps = array(
+            "d", [self.start.timestamp() + 5 * 60 * i for i in range(1, 5)]
+        )
+        self.rows = StatsBatch(
+            "NE=1", pytz.utc, timestamps, ["active_power"], [[1] * 4]
+        )
+        self.checkpoints = Checkpoints()
+
+    def test_rewinds_to_last_saved_record_when_output_fails(self):
+        # given
+        output = Mock()
+        output.save.__name__ = "save"  # logged by backoff
+        output.save.side_effect = [Exception("down"), None]
+        worker = OutputWorker(
+            "NE=1", "PVOutput", output, self.checkpoints, self.start, max_tries=1
+        )
+        worker.submit(self.rows[:2])
+        worker.submit(self.rows[:3])  # queued after the failing batch, discarded
+
+        # when
+        worker.start()
+        worker.queue.join()
+        worker.submit(self.rows)
+        worker.queue.join()
+
+        # then
+        saved = [call.args[0].times() for call in output.save.call_args_list]
+        self.assertEqual(saved, [self.rows[:2].times(), self.rows.times()])
+        self.assertEqual(self.checkpoints.get("NE=1", "PVOutput"), self.rows[-1].ts)
+        self.assertEqual((worker.saved, worker.failed), (4, 2))
+
+    def test_drops_batches_when_queue_is_full(self):
+        # given
+        output = Mock()
+        worker = OutputWorker(
+            "NE=1", "PVOutput", output, self.checkpoints, self.start, queue_size=1
+        )
+
+        # when
+        worker.submit(self.rows[:2])
+        dropped = worker.submit(self.rows)
+
+        # then
+        self.assertEqual(dropped, 0)
+        self.assertEqual(worker.dropped, 2)
+        self.assertEqual(worker.queued_ts, self.rows[1].ts)
+
+
+class TestSyncOutputs(unittest.TestCase):
+    def test_keeps_up_to_date_output_going_while_other_is_behind(self):
+        # given
+        now = pytz.utc.localize(datetime(2022, 10, 30, 12, 0))
+        stuck_ts = now - timedelta(days=10)
+        checkpoints = Checkpoints()
+        stuck = OutputWorker("NE=1", "PostgreSQL", Mock(), checkpoints, stuck_ts)
+        fresh = OutputWorker("NE=1", "PVOutput", Mock(), checkpoints, now)
+
+        def query(starting_ts):
+            # like FusionSolar: samples of 2 days, up to now
+            day = starting_ts.replace(hour=0, minute=0)
+            timestamps = array(
+                "d",
+                [
+                    ts
+                    for ts in range(
+                        int(day.timestamp()), int(day.timestamp()) + 2 * 86400, 300
+                    )
+                    if ts <= (now + timedelta(minutes=10)).timestamp()
+                ],
+            )
+            return StatsBatch(
+                "NE=1", pytz.utc, timestamps, ["active_power"], [[1] * len(timestamps)]
+            )
+
+        # when
+        newest = sync_outputs([fresh, stuck], query, pytz.utc)
+
+        # then
+        self.assertEqual(newest, now + timedelta(minutes=10))
+        self.assertEqual(fresh.queued_ts, now + timedelta(minutes=10))
+        self.assertEqual(
+            stuck.queued_ts,
+            stuck_ts.replace(hour=0) + timedelta(days=2) - timedelta(minutes=5),
+        )
+        self.assertEqual((fresh.queue.qsize(), stuck.queue.qsize()), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from datetime import date, datetime, timedelta, timezone
+
+from scheduler import Scheduler, sun_times
+
+WARSAW = (52.23, 21.01)
+
+
+class TestScheduler(unittest.TestCase):
+    def test_computes_sunrise_and_sunset(self):
+        # when
+        sunrise, sunset = sun_times(date(2024, 6, 21), *WARSAW)
+
+        # then
+        expected_sunrise = datetime(2024, 6, 21, 2, 14, tzinfo=timezone.utc)
+        expected_sunset = datetime(2024, 6, 21, 19, 1, tzinfo=timezone.utc)
+        self.assertLess(abs(sunrise - expected_sunrise), timedelta(minutes=2))
+        self.assertLess(abs(sunset - expected_sunset), timedelta(minutes=2))
+
+    def test_polls_after_next_sample_and_backs_off_while_it_is_missing(self):
+        # given
+        scheduler = Scheduler(lag=timedelta(minutes=1))
+        newest = datetime(2024, 6, 21, 10, 0, tzinfo=timezone.utc)
+        now = newest + timedelta(minutes=1, seconds=20)
+
+        # when
+        first = scheduler.next_poll(newest, now)
+        retries = [
+            scheduler.next_poll(newest, first),
+            scheduler.next_poll(newest, first),
+        ]
+
+        # then
+        self.assertEqual(first, newest + timedelta(minutes=6))
+        self.assertEqual(
+            retries,
+            [first + timedelta(seconds=30), first + timedelta(seconds=60)],
+        )
+
+    def test_learns_publish_lag_from_late_sample(self):
+        # given
+        scheduler = Scheduler(lag=timedelta(minutes=1))
+        newest = datetime(2024, 6, 21, 10, 0, tzinfo=timezone.utc)
+        scheduler.next_poll(newest, newest + timedelta(minutes=1))
+        scheduler.next_poll(newest, newest + timedelta(minutes=6))  # missing
+
+        # when
+        late = newest + timedelta(minutes=5)
+        next_poll = scheduler.next_poll(late, late + timedelta(minutes=2))
+
+        # then
+        self.assertEqual(scheduler.lag, timedelta(minutes=2))
+        self.assertEqual(next_poll, late + timedelta(minutes=7))
+
+    def test_aligns_stale_data_to_sample_grid(self):
+        # given
+        scheduler = Scheduler(lag=timedelta(minutes=1))
+        newest = datetime(2024, 6, 20, 10, 0, tzinfo=timezone.utc)
+        now = datetime(2024, 6, 21, 10, 3, 12, tzinfo=timezone.utc)
+
+        # when
+        next_poll = scheduler.next_poll(newest, now)
+
+        # then
+        self.assertEqual(next_poll, datetime(2024, 6, 21, 10, 6, tzinfo=timezone.utc))
+
+    def test_sleeps_until_sunrise_at_night(self):
+        # given
+        scheduler = Scheduler(latitude=WARSAW[0], longitude=WARSAW[1])
+        newest = datetime(2024, 6, 21, 19, 30, tzinfo=timezone.utc)
+
+        # when
+        next_poll = scheduler.next_poll(newest, newest + timedelta(minutes=1))
+
+        # then
+        sunrise, _ = sun_times(date(2024, 6, 22), *WARSAW)
+        self.assertEqual(next_poll, sunrise)
+
+    def test_keeps_sleeping_at_night_while_samples_are_missing(self):
+        # given
+        scheduler = Scheduler(latitude=WARSAW[0], longitude=WARSAW[1])
+        newest = datetime(2024, 6, 21, 19, 30, tzinfo=timezone.utc)
+        scheduler.next_poll(newest, newest + timedelta(minutes=1))
+
+        # when
+        next_poll = scheduler.next_poll(newest, newest + timedelta(minutes=40))
+
+        # then
+        sunrise, _ = sun_times(date(2024, 6, 22), *WARSAW)
+        self.assertEqual(next_poll, sunrise)
+
+    def test_catches_up_at_night_with_stale_data(self):
+        # given
+        scheduler = Scheduler(latitude=WARSAW[0], longitude=WARSAW[1])
+        newest = datetime(2024, 6, 11, 12, 0, tzinfo=timezone.utc)
+        now = datetime(2024, 6, 21, 21, 0, tzinfo=timezone.utc)
+
+        # when
+        next_poll = scheduler.next_poll(newest, now)
+
+        # then
+        self.assertEqual(next_poll, datetime(2024, 6, 21, 21, 1, tzinfo=timezone.utc))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import signal
+import time
+
+import aiohttp
+import aiomqtt
+import backoff
+from influxdb_client import Point
+
+import filters
+import metrics
+import rollups
+from parsers import SCHEMAS, router
+
+
+async def ingest(args, messages):
+    tls_params = None
+    if args.mqtt_ca_crt and args.mqtt_client_crt and args.mqtt_client_key:
+        tls_params = aiomqtt.TLSParameters(
+            ca_certs=args.mqtt_ca_crt,
+            certfile=args.mqtt_client_crt,
+            keyfile=args.mqtt_client_key,
+        )
+    while True:
+        try:
+            async with aiomqtt.Client(
+                args.mqtt_host,
+                args.mqtt_port,
+                client_id=args.mqtt_client_id,
+                tls_params=tls_params,
+            ) as client:
+                # client's own queue is bounded too, it drops (and logs) messages
+                # when parsing falls behind instead of growing without limit
+                async with client.messages(queue_maxsize=args.queue_size) as incoming:
+                    logging.info("Connected to %s:%d", args.mqtt_host, args.mqtt_port)
+                    await client.subscribe(args.mqtt_topic)
+                    async for message in incoming:
+                        await messages.put(message)
+        except aiomqtt.MqttError:
+            logging.exception("MQTT connection lost, reconnecting in 5s")
+            await asyncio.sleep(5)
+
+
+async def parse(messages, lines):
+    while True:
+        message = await messages.get()
+        topic = message.topic.value
+        try:
+            parser = router.match(topic)
+            metrics.MESSAGES_RECEIVED.labels(metrics.parser_name(parser)).inc()
+            if parser is None:
+                continue
+            with metrics.PARSE_SECONDS.time():
+                line = parser(topic, json.loads(message.payload))
+            if isinstance(line, Point):
+                line = line.to_line_protocol().encode("utf-8")
+            if line:
+                await lines.put(line)
+        except:
+            metrics.PARSE_ERRORS.inc()
+            logging.exception("Unable to process %s: %s", topic, message.payload)
+        finally:
+            messages.task_done()
+
+
+class QueueSpool:
+    """Exposes points queue for metrics the same way as spool does"""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.dropped = 0
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def count_dropped(self, records):
+        self.dropped += records
+
+
+def rejected(exception):
+    """InfluxDB refused the points for good, e.g. on a field type conflict"""
+    return (
+        isinstance(exception, aiohttp.ClientResponseError)
+        and 400 <= exception.status < 500
+        and exception.status != 429
+    )
+
+
+class InfluxAsyncWriter:
+    def __init__(self, args, session, spool):
+        self.url = f"{args.influxdb_url}/api/v2/write"
+        self.session = session
+        self.spool = spool
+        self.batch_size = args.influxdb_batch_size
+        self.batch_bytes = args.influxdb_batch_bytes
+        self.flush_interval = args.influxdb_flush_interval
+        self.carry = None
+
+    # ClientTimeout raises plain asyncio.TimeoutError, not a ClientError
+    @backoff.on_exception(
+        backoff.expo,
+        (aiohttp.ClientError, asyncio.TimeoutError),
+        max_value=60,
+        giveup=rejected,
+        on_backoff=metrics.count_retry,
+    )
+    async def push(self, lines):
+        started = time.monotonic()
+        async with self.session.post(
+            self.url,
+            params={"org": "-", "bucket": "mqtt/autogen", "precision": "ns"},
+            headers={"Authorization": "Token -"},
+            data=b"\n".join(lines),
+        ) as response:
+            metrics.WRITE_SECONDS.observe(time.monotonic() - started)
+            response.raise_for_status()
+
+    async def next_batch(self, lines):
+        line, self.carry = self.carry or await lines.get(), None
+        batch, size = [line], len(line)
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(lines.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if size + len(line) + 1 > self.batch_bytes:
+                self.carry = line
+                break
+            batch.append(line)
+            size += len(line) + 1
+        return batch
+
+    async def run(self, lines):
+        while True:
+            batch = await self.next_batch(lines)
+            metrics.WRITE_BATCH_SIZE.observe(len(batch))
+            try:
+                await self.push(batch)
+            except aiohttp.ClientResponseError as e:
+                # retrying won't help, skip the batch instead of blocking on it
+                logging.error("InfluxDB rejected %d points: %s", len(batch), e)
+                self.spool.count_dropped(len(batch))
+            for _ in batch:
+                lines.task_done()
+
+
+async def main(args):
+    messages = asyncio.Queue(args.queue_size)
+    lines = asyncio.Queue(args.queue_size)
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+
+    spool = QueueSpool(lines)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port, spool)
+
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=60)
+    ) as session:
+        writer = InfluxAsyncWriter(args, session, spool)
+        ingester = asyncio.create_task(ingest(args, messages))
+        workers = [asyncio.create_task(parse(messages, lines))]
+        workers.append(asyncio.create_task(writer.run(lines)))
+        stop = asyncio.create_task(stopped.wait())
+
+        # stages run forever, one finishing means it died
+        done, _ = await asyncio.wait(
+            [stop, ingester, *workers], return_when=asyncio.FIRST_COMPLETED
+        )
+        failed = [task for task in done if task is not stop]
+        for task in failed:
+            logging.error("Pipeline stage stopped, exiting", exc_info=task.exception())
+
+        if not failed:
+            logging.info("Flushing pending points to InfluxDB")
+            ingester.cancel()
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(messages.join(), lines.join()),
+                    args.shutdown_timeout,
+                )
+            except asyncio.TimeoutError:
+                logging.error(
+                    "Points not flushed in %ss, %d dropped",
+                    args.shutdown_timeout,
+                    lines.qsize(),
+                )
+        stop.cancel()
+        for task in (ingester, *workers):
+            task.cancel()
+        await asyncio.gather(stop, ingester, *workers, return_exceptions=True)
+        if failed:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s %(message)s")
+    logging.getLogger().setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--influxdb-url", default="http://influxdb.iot.svc:8086")
+    parser.add_argument("--influxdb-batch-size", type=int, default=1000)
+    parser.add_argument("--influxdb-batch-bytes", type=int, default=1024 * 1024)
+    parser.add_argument("--influxdb-flush-interval", type=float, default=1.0)
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=10000,
+        help="Max number of messages waiting for parsing and of points waiting for InfluxDB",
+    )
+    parser.add_argument(
+        "--shutdown-timeout",
+        type=float,
+        default=30,
+        help="Max seconds to wait for pending points to be written on shutdown",
+    )
+    parser.add_argument("--metrics-port", type=int)
+    parser.add_argument("--filters")
+    parser.add_argument("--rollup-windows", type=int, nargs="*", default=[])
+    parser.add_argument(
+        "--rollup-fields", nargs="*", default=["power", "voltage", "current"]
+    )
+    parser.add_argument("--mqtt-topic", default="tele/#")
+    parser.add_argument("--ignore-topic", action="append", default=[])
+    parser.add_argument("--parser-plugin", action="append", default=[])
+    parser.add_argument("--mqtt-client-id", default="MQTTInfluxDBBridge")
+    parser.add_argument("--mqtt-host", default="mosquitto-internal")
+    parser.add_argument("--mqtt-port", type=int, default=1884)
+    parser.add_argument("--mqtt-ca-crt")
+    parser.add_argument("--mqtt-client-crt")
+    parser.add_argument("--mqtt-client-key")
+    args = parser.parse_args()
+    logging.info("Starting asyncio MQTT to InfluxDB bridge, %s", args)
+
+    for plugin in args.parser_plugin:
+        importlib.import_module(plugin)
+    for topic_filter in args.ignore_topic:
+        router.ignore(topic_filter)
+    if args.filters is not None:
+        filters.configure(args.filters, SCHEMAS)
+    if args.rollup_windows:
+        rollups.configure(
+            SCHEMAS["smartplugsensor"], args.rollup_fields, args.rollup_windows
+        )
+
+    asyncio.run(main(args))
@@ -0,0 +1,79 @@
+"""Compares direct line protocol encoding with the influxdb_client Point path.
+
+Run from the mqttbridge directory: python -m benchmarks.encoder
+"""
+import timeit
+import tracemalloc
+
+from influxdb_client import Point
+
+from benchmarks.samples import SENSOR, SENSOR_TOPIC, STATE, STATE_TOPIC
+from parsers import parse_sensor_msg, parse_state_msg, parse_time
+
+
+def point_state_msg(topic, msg):
+    return (
+        Point.measurement("smartplugstate")
+        .time(parse_time(msg["Time"]))
+        .tag("spid", int(topic.split("/")[2]))
+        .field("uptime_sec", msg["UptimeSec"])
+        .field("heap", msg["Heap"])
+        .field("sleep_mode", msg["SleepMode"])
+        .field("sleep", msg["Sleep"])
+        .field("loadavg", msg["LoadAvg"])
+        .field("mqtt_count", msg["MqttCount"])
+        .field("power", msg["POWER"])
+        .field("is_on", msg["POWER"] == "ON")
+        .field("wifi_channel", msg["Wifi"]["Channel"])
+        .field("wifi_rssi", msg["Wifi"]["RSSI"])
+        .field("wifi_signal", msg["Wifi"]["Signal"])
+        .field("wifi_link_count", msg["Wifi"]["LinkCount"])
+        .to_line_protocol()
+        .encode("utf-8")
+    )
+
+
+def point_sensor_msg(topic, msg):
+    time = parse_time(msg["Time"])
+    msg = msg["ENERGY"]
+    return (
+        Point.measurement("smartplugsensor")
+        .time(time)
+        .tag("spid", int(topic.split("/")[2]))
+        .field("total_start_time", msg["TotalStartTime"])
+        .field("total", msg["Total"])
+        .field("yesterday", msg["Yesterday"])
+        .field("today", msg["Today"])
+        .field("period", msg["Period"])
+        .field("power", msg["Power"])
+        .field("apparent_power", msg["ApparentPower"])
+        .field("reactive_power", msg["ReactivePower"])
+        .field("factor", msg["Factor"])
+        .field("voltage", msg["Voltage"])
+        .field("current", msg["Current"])
+        .to_line_protocol()
+        .encode("utf-8")
+    )
+
+
+def measure(name, func, topic, msg, number=20000):
+    seconds = min(timeit.repeat(lambda: func(topic, msg), number=number, repeat=5))
+    tracemalloc.start()
+    for _ in range(1000):
+        func(topic, msg)
+    allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(
+        f"{name:<16} {seconds / number * 1e6:8.2f} us/msg {number / seconds:10.0f} msg/s"
+        f" {allocated:8d} B peak"
+    )
+
+
+if __name__ == "__main__":
+    for (name, topic, msg, encoder, point) in [
+        ("STATE", STATE_TOPIC, STATE, parse_state_msg, point_state_msg),
+        ("SENSOR", SENSOR_TOPIC, SENSOR, parse_sensor_msg, point_sensor_msg),
+    ]:
+        assert encoder(topic, msg) == point(topic, msg)
+        measure(f"{name} Point", point, topic, msg)
+        measure(f"{name} encoder", encoder, topic, msg)
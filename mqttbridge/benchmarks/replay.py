@@ -0,0 +1,164 @@
+"""Replays Tasmota and mitemp messages through on_message and the InfluxDB pusher.
+
+Points end up in a local stub of the InfluxDB write endpoint, so it runs offline.
+Every message gets a unique timestamp, that's how points are matched with
+messages to measure end-to-end latency. Run from the mqttbridge directory:
+
+    python -m benchmarks.replay --messages 50000 --workers 2
+    python -m benchmarks.replay --recording mosquitto_sub.log
+
+Recording is mosquitto_sub -v output (topic, space, payload per line).
+"""
+import argparse
+import copy
+import json
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import main
+from benchmarks.samples import MITEMP, MITEMP_TOPIC, SENSOR, STATE
+from benchmarks.stub import StubInfluxDB
+from parsers import clock
+from pool import ShardedPool
+from spool import DiskSpool, MemorySpool
+
+START = datetime(2024, 1, 10)
+
+
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def synthetic(devices):
+    while True:
+        for device in range(devices):
+            yield f"tele/smartplug/{device}/STATE", STATE
+            yield f"tele/smartplug/{device}/SENSOR", SENSOR
+            if device % 10 == 0:
+                yield f"{MITEMP_TOPIC}{device}", MITEMP
+
+
+def recorded(path):
+    with open(path) as recording:
+        samples = [line.rstrip("\n").split(" ", 1) for line in recording if " " in line]
+    samples = [(topic, json.loads(payload)) for topic, payload in samples]
+    while True:
+        yield from samples
+
+
+def build_messages(samples, count):
+    """Returns messages and timestamp (ns) of the point each one produces"""
+    messages, timestamps = [], []
+    for i, (topic, payload) in zip(range(count), samples):
+        payload = copy.deepcopy(payload)
+        local_time = (START + timedelta(seconds=i)).isoformat()
+        timestamps.append(clock.epoch_ns(local_time))
+        if "Time" in payload:
+            payload["Time"] = local_time
+        else:
+            payload["timestamp"] = timestamps[-1] // 1000000000
+        messages.append(Message(topic, json.dumps(payload).encode("utf-8")))
+    return messages, timestamps
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(args):
+    influxdb = StubInfluxDB()
+    args.influxdb_url = influxdb.url
+    if args.spool_dir is None:
+        spool = MemorySpool()
+    else:
+        spool = DiskSpool(args.spool_dir, 16 * 1024 * 1024, 1024**3)
+    main.influxdb_pusher = main.InfluxAsyncPusher(args, spool)
+    main.influxdb_pusher.start()
+    handler = main.on_message_handling_exceptions
+    if args.workers > 0:
+        main.worker_pool = ShardedPool(args.workers, handler)
+        main.worker_pool.start()
+        handler = main.on_message_in_pool
+
+    samples = recorded(args.recording) if args.recording else synthetic(args.devices)
+    messages, timestamps = build_messages(samples, args.messages)
+    sent = [0.0] * len(messages)
+    interval = 1 / args.rate if args.rate else 0
+
+    started = time.perf_counter()
+    for i, message in enumerate(messages):
+        if interval:
+            while time.perf_counter() < started + i * interval:
+                pass
+        sent[i] = time.perf_counter()
+        handler(None, None, message)
+
+    deadline = time.perf_counter() + args.timeout
+    while len(influxdb.received) < len(set(timestamps)):
+        if time.perf_counter() > deadline:
+            sys.exit(f"Timeout, received {len(influxdb.received)} points")
+        time.sleep(0.01)
+    finished = max(influxdb.received.values())
+
+    first_sent = {}
+    for ts, sent_at in zip(timestamps, sent):
+        first_sent.setdefault(ts, sent_at)
+    latencies = sorted(
+        influxdb.received[ts] - sent_at for ts, sent_at in first_sent.items()
+    )
+    result = {
+        "messages": len(messages),
+        "requests": influxdb.requests,
+        "msgs_per_s": len(messages) / (finished - started),
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+    if main.worker_pool is not None:
+        main.worker_pool.stop()
+    main.influxdb_pusher.stop()
+    main.influxdb_pusher.join()
+    influxdb.shutdown()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--recording", help="mosquitto_sub -v output to replay")
+    parser.add_argument(
+        "--rate", type=float, help="Messages per second, unlimited by default"
+    )
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--spool-dir", help="Use disk spool, temporary dir if 'tmp'")
+    parser.add_argument("--influxdb-batch-size", type=int, default=1000)
+    parser.add_argument("--influxdb-batch-bytes", type=int, default=1024 * 1024)
+    parser.add_argument("--influxdb-flush-interval", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true", help="Print result as JSON")
+    parser.add_argument(
+        "--min-rate",
+        type=float,
+        help="Exit with error when throughput is lower (for CI)",
+    )
+    args = parser.parse_args()
+
+    if args.spool_dir == "tmp":
+        spool_dir = tempfile.TemporaryDirectory()
+        args.spool_dir = spool_dir.name
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f"{key:<16} {value:12.1f}")
+    if args.min_rate is not None and result["msgs_per_s"] < args.min_rate:
+        sys.exit(f"Throughput {result['msgs_per_s']:.0f} msgs/s below {args.min_rate}")
@@ -0,0 +1,50 @@
+STATE_TOPIC = "tele/smartplug/3/STATE"
+STATE = {
+    "Time": "2024-04-21T18:00:00",
+    "Uptime": "0T01:00:00",
+    "UptimeSec": 3600,
+    "Heap": 26,
+    "SleepMode": "Dynamic",
+    "Sleep": 50,
+    "LoadAvg": 19,
+    "MqttCount": 1,
+    "POWER": "ON",
+    "Wifi": {
+        "AP": 1,
+        "SSId": "home",
+        "BSSId": "00:00:00:00:00:00",
+        "Channel": 6,
+        "Mode": "11n",
+        "RSSI": 78,
+        "Signal": -61,
+        "LinkCount": 1,
+        "Downtime": "0T00:00:03",
+    },
+}
+
+SENSOR_TOPIC = "tele/smartplug/3/SENSOR"
+SENSOR = {
+    "Time": "2024-04-21T18:00:00",
+    "ENERGY": {
+        "TotalStartTime": "2021-01-03T12:00:00",
+        "Total": 1234.56789,
+        "Yesterday": 1.23456,
+        "Today": 0.54321,
+        "Period": 12,
+        "Power": 45.123,
+        "ApparentPower": 60.456,
+        "ReactivePower": 39.789,
+        "Factor": 0.75,
+        "Voltage": 233.456,
+        "Current": 0.259,
+    },
+}
+
+MITEMP_TOPIC = "tele/temp/salon"
+MITEMP = {
+    "temperature": 21.4,
+    "humidity": 45,
+    "batt_voltage": 2.958,
+    "batt_level": 82,
+    "timestamp": 1713715200,
+}
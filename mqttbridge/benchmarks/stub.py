@@ -0,0 +1,54 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubInfluxDB(ThreadingHTTPServer):
+    """Accepts InfluxDB v2 writes and remembers when each point's timestamp arrived.
+
+    The first failures writes are answered with failure_status instead, lines
+    of the accepted ones are kept in order.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, failures=0, failure_status=503):
+        self.lines = []
+        self.received = {}
+        self.requests = 0
+        self.failures = failures
+        self.failure_status = failure_status
+        self.lock = threading.Lock()
+        outer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                now = time.perf_counter()
+                with outer.lock:
+                    outer.requests += 1
+                    if outer.failures > 0:
+                        outer.failures -= 1
+                        status = outer.failure_status
+                    else:
+                        status = 204
+                        for line in body.split(b"\n"):
+                            outer.lines.append(line)
+                            timestamp = line.rsplit(b" ", 1)[-1]
+                            if timestamp.isdigit():
+                                outer.received.setdefault(int(timestamp), now)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
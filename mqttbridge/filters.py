@@ -0,0 +1,90 @@
+import json
+import logging
+from array import array
+from collections import deque
+
+NEVER = -(2**63)
+
+
+class Series:
+    __slots__ = ("values", "emitted", "recent")
+
+    def __init__(self, fields, dedupe_window):
+        self.values = [None] * fields
+        self.emitted = array("q", [NEVER] * fields)
+        self.recent = deque(maxlen=dedupe_window)
+
+
+class ChangeFilter:
+    """Drops repeated messages and field values which haven't changed.
+
+    Duplicates are detected by series (measurement tags) and timestamp, which
+    is what broker re-deliveries look like. Each field in deadbands is written
+    only when it moved by more than its deadband since the last written value
+    (0 means any change), or when it wasn't written for heartbeat seconds.
+    """
+
+    def __init__(self, schema, deadbands, heartbeat=300, dedupe=True, dedupe_window=16):
+        self.fields = [
+            (schema.field_names.index(name), deadband)
+            for name, deadband in deadbands.items()
+        ]
+        self.heartbeat_ns = int(heartbeat * 1e9)
+        self.dedupe_window = dedupe_window if dedupe else 0
+        self.series = {}
+        self.duplicates = 0
+        self.suppressed = 0
+
+    def __call__(self, tags, values, time_ns):
+        series = self.series.get(tags)
+        if series is None:
+            series = self.series[tags] = Series(len(self.fields), self.dedupe_window)
+
+        if self.dedupe_window:
+            if time_ns in series.recent:
+                self.duplicates += 1
+                return None
+            series.recent.append(time_ns)
+
+        for slot, (index, deadband) in enumerate(self.fields):
+            value = values[index]
+            if value is None:
+                continue
+            last = series.values[slot]
+            if time_ns - series.emitted[slot] < self.heartbeat_ns and unchanged(
+                value, last, deadband
+            ):
+                values[index] = None
+                self.suppressed += 1
+            else:
+                series.values[slot] = value
+                series.emitted[slot] = time_ns
+
+        if all(value is None for value in values):
+            return None
+        return values
+
+
+def unchanged(value, last, deadband):
+    if deadband and type(value) in (int, float) and type(last) in (int, float):
+        return abs(value - last) <= deadband
+    return value == last
+
+
+def configure(path, schemas):
+    """Sets up filters from a JSON file, keyed by measurement name, e.g.
+
+    {"smartplugstate": {"heartbeat": 600, "dedupe": true,
+                        "fields": {"wifi_channel": 0, "heap": 2}}}
+    """
+    with open(path) as config_file:
+        config = json.load(config_file)
+    for measurement, options in config.items():
+        schema = schemas[measurement]
+        schema.filter = ChangeFilter(
+            schema,
+            options.get("fields", {}),
+            heartbeat=options.get("heartbeat", 300),
+            dedupe=options.get("dedupe", True),
+        )
+        logging.info("Filtering %s: %s", measurement, options)
@@ -0,0 +1,130 @@
+import math
+import operator
+import threading
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime.fromtimestamp(0, tz=timezone.utc)
+
+_ESCAPE_MEASUREMENT = str.maketrans(
+    {",": r"\,", " ": r"\ ", "\n": r"\n", "\t": r"\t", "\r": r"\r"}
+)
+_ESCAPE_KEY = str.maketrans(
+    {",": r"\,", "=": r"\=", " ": r"\ ", "\n": r"\n", "\t": r"\t", "\r": r"\r"}
+)
+_ESCAPE_STRING = str.maketrans({'"': r"\"", "\\": r"\\"})
+
+
+def to_nanoseconds(time):
+    return (time - EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def _getter(path):
+    if callable(path):
+        return path
+    if isinstance(path, str):
+        return operator.itemgetter(path)
+
+    def get(msg):
+        for key in path:
+            msg = msg[key]
+        return msg
+
+    return get
+
+
+def _escape_tag_value(value):
+    value = str(value).translate(_ESCAPE_KEY)
+    return value + " " if value.endswith("\\") else value
+
+
+class Schema:
+    """Encodes a measurement with fixed tags and fields straight into line protocol.
+
+    Fields are given as (name, path) pairs, where path is a payload key, a tuple
+    of nested keys or a callable taking the payload. Output is byte-identical
+    to influxdb_client's Point, so field types in InfluxDB stay the same.
+
+    Optional filter is called with tags, field values (in field_names order)
+    and time, it returns values to write (None skips a field) or None to skip
+    the whole line. Optional rollup gets raw values before filtering and may
+    return extra lines to write along.
+    """
+
+    def __init__(self, measurement, tags, fields):
+        self.name = measurement
+        self.tag_names = list(tags)
+        self.measurement = measurement.translate(_ESCAPE_MEASUREMENT).encode("utf-8")
+        self.tags = [
+            (index, ("," + tag.translate(_ESCAPE_KEY) + "=").encode("utf-8"))
+            for tag, index in sorted((tag, index) for index, tag in enumerate(tags))
+        ]
+        fields = sorted(fields, key=operator.itemgetter(0))
+        self.field_names = [name for name, _ in fields]
+        self.keys = [
+            name.translate(_ESCAPE_KEY).encode("utf-8") + b"=" for name, _ in fields
+        ]
+        self.getters = [_getter(path) for _, path in fields]
+        self.filter = None
+        self.rollup = None
+        self.local = threading.local()
+
+    def encode(self, tags, msg, time_ns):
+        """Returns line protocol bytes, or None if there are no fields to write"""
+        values = [get(msg) for get in self.getters]
+        extra = None
+        if self.rollup is not None:
+            extra = self.rollup(tags, values, time_ns)
+        if self.filter is not None:
+            values = self.filter(tags, values, time_ns)
+        line = None if values is None else self.encode_values(tags, values, time_ns)
+        if extra is None:
+            return line
+        return extra if line is None else line + b"\n" + extra
+
+    def encode_values(self, tags, values, time_ns):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            buffer = self.local.buffer = bytearray()
+        del buffer[:]
+
+        buffer += self.measurement
+        for index, key in self.tags:
+            value = tags[index]
+            if value is None:
+                continue
+            value = _escape_tag_value(value)
+            if value:
+                buffer += key
+                buffer += value.encode("utf-8")
+
+        separator = b" "
+        for key, value in zip(self.keys, values):
+            value_type = type(value)
+            if value is None:
+                continue
+            elif value_type is float:
+                if not math.isfinite(value):
+                    continue
+                encoded = repr(value)
+                if encoded.endswith(".0"):
+                    encoded = encoded[:-2]
+                encoded = encoded.encode("ascii")
+            elif value_type is bool:
+                encoded = b"true" if value else b"false"
+            elif value_type is int:
+                encoded = b"%di" % value
+            elif value_type is str:
+                encoded = b'"' + value.translate(_ESCAPE_STRING).encode("utf-8") + b'"'
+            else:
+                raise ValueError(
+                    f'Type: "{value_type}" of field: "{key[:-1].decode()}" is not supported.'
+                )
+            buffer += separator
+            buffer += key
+            buffer += encoded
+            separator = b","
+
+        if separator == b" ":
+            return None
+        buffer += b" %d" % time_ns
+        return bytes(buffer)
@@ -1,25 +1,29 @@
 import argparse
+import importlib
 import json
 import logging
-import queue
+import signal
 import threading
-from datetime import datetime
+import time
 
 import backoff
-import pytz
-from influxdb_client import Configuration, InfluxDBClient, Point
+from influxdb_client import InfluxDBClient, Point
 from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
 
+import filters
+import metrics
 import paho.mqtt.client as mqtt
+import rollups
+from parsers import SCHEMAS, router
+from pool import ShardedPool
+from spool import DiskSpool, MemorySpool
 
 influxdb_pusher = None
+worker_pool = None
 args = None
 
 
-def parse_time(time):
-    return pytz.timezone("Europe/Warsaw").localize(datetime.fromisoformat(time))
-
-
 def on_connect(client, userdata, flags, rc):
     logging.info("Connected with result code %d", rc)
     client.subscribe(args.mqtt_topic)
@@ -29,98 +33,88 @@ def on_message_handling_exceptions(client, userdata, msg):
     try:
         on_message(client, userdata, msg)
     except:
+        metrics.PARSE_ERRORS.inc()
         logging.exception("Unable to process %s: %s", msg.topic, msg.payload)
 
 
-def on_message(client, userdata, msg):
-    if msg.topic == "tele/ecoal/STATE":
-        return  # not using ecoal anymore :-)
-
-    if msg.topic.endswith("STATE"):
-        point = parse_state_msg(msg.topic, json.loads(msg.payload.decode("utf-8")))
-    elif msg.topic.endswith("SENSOR"):
-        point = parse_sensor_msg(msg.topic, json.loads(msg.payload.decode("utf-8")))
-    elif msg.topic.startswith("tele/temp"):
-        point = parse_mitemp_msg(msg.topic, json.loads(msg.payload.decode("utf-8")))
-    else:
-        return
+def on_message_in_pool(client, userdata, msg):
+    worker_pool.submit(msg.topic, client, userdata, msg)
 
-    influxdb_pusher.write(point)
 
+def log_stats_periodically(interval):
+    while True:
+        time.sleep(interval)
+        worker_pool.log_stats()
 
-def parse_mitemp_msg(topic, msg):
-    sensor_name = topic.split("/")[-1]
-    return (
-        Point.measurement("mitemperature")
-        .time(datetime.fromtimestamp(msg["timestamp"]))
-        .tag("room", sensor_name)
-        .field("temperature", msg["temperature"])
-        .field("humidity", msg["humidity"])
-        .field("batt_voltage", msg["batt_voltage"])
-        .field("batt_level", msg["batt_level"])
-    )
 
+def on_message(client, userdata, msg):
+    parser = router.match(msg.topic)
+    metrics.MESSAGES_RECEIVED.labels(metrics.parser_name(parser)).inc()
+    if parser is None:
+        return
 
-def parse_state_msg(topic, msg):
-    return (
-        Point.measurement("smartplugstate")
-        .time(parse_time(msg["Time"]))
-        .tag("spid", int(topic.split("/")[2]))
-        .field("uptime_sec", msg["UptimeSec"])
-        .field("heap", msg["Heap"])
-        .field("sleep_mode", msg["SleepMode"])
-        .field("sleep", msg["Sleep"])
-        .field("loadavg", msg["LoadAvg"])
-        .field("mqtt_count", msg["MqttCount"])
-        .field("power", msg["POWER"])
-        .field("is_on", msg["POWER"] == "ON")
-        .field("wifi_channel", msg["Wifi"]["Channel"])
-        .field("wifi_rssi", msg["Wifi"]["RSSI"])
-        .field("wifi_signal", msg["Wifi"]["Signal"])
-        .field("wifi_link_count", msg["Wifi"]["LinkCount"])
-    )
-
-
-def parse_sensor_msg(topic, msg):
-    time = parse_time(msg["Time"])
-    msg = msg["ENERGY"]
+    with metrics.PARSE_SECONDS.time():
+        line = parser(msg.topic, json.loads(msg.payload))
+    influxdb_pusher.write(line)
+
+
+def rejected(exception):
+    """InfluxDB refused the points for good, e.g. on a field type conflict"""
     return (
-        Point.measurement("smartplugsensor")
-        .time(time)
-        .tag("spid", int(topic.split("/")[2]))
-        .field("total_start_time", msg["TotalStartTime"])
-        .field("total", msg["Total"])
-        .field("yesterday", msg["Yesterday"])
-        .field("today", msg["Today"])
-        .field("period", msg["Period"])
-        .field("power", msg["Power"])
-        .field("apparent_power", msg["ApparentPower"])
-        .field("reactive_power", msg["ReactivePower"])
-        .field("factor", msg["Factor"])
-        .field("voltage", msg["Voltage"])
-        .field("current", msg["Current"])
+        isinstance(exception, ApiException)
+        and exception.status is not None
+        and 400 <= exception.status < 500
+        and exception.status != 429
     )
 
 
 class InfluxAsyncPusher(threading.Thread):
-    def __init__(self, args):
-        super().__init__()
+    def __init__(self, args, spool):
+        super().__init__(daemon=True)
         self.client = InfluxDBClient(url=args.influxdb_url, token="-", org="-")
-        self.queue = queue.Queue()
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        self.batch_size = args.influxdb_batch_size
+        self.batch_bytes = args.influxdb_batch_bytes
+        self.flush_interval = args.influxdb_flush_interval
+        self.spool = spool
 
-    def write(self, point):
-        self.queue.put(point)
+    def write(self, line):
+        if isinstance(line, Point):  # parser plugins may still build Points
+            line = line.to_line_protocol().encode("utf-8")
+        if line and not self.spool.put(line):
+            logging.warning("Spool full, dropping %s", line)
 
-    @backoff.on_exception(backoff.expo, Exception)
-    def push(self, point):
-        self.client.write_api(write_options=SYNCHRONOUS).write(
-            bucket="mqtt/autogen", record=point
-        )
+    def stop(self):
+        self.spool.close()
+
+    @backoff.on_exception(
+        backoff.expo,
+        Exception,
+        max_value=60,
+        giveup=rejected,
+        on_backoff=metrics.count_retry,
+    )
+    @metrics.WRITE_SECONDS.time()
+    def push(self, lines):
+        self.write_api.write(bucket="mqtt/autogen", record=b"\n".join(lines))
 
     def run(self):
         while True:
-            self.push(self.queue.get())
-            self.queue.task_done()
+            lines, position = self.spool.get_batch(
+                self.batch_size, self.batch_bytes, self.flush_interval
+            )
+            if not lines:
+                break
+            metrics.WRITE_BATCH_SIZE.observe(len(lines))
+            try:
+                self.push(lines)
+            except ApiException as e:
+                # retrying won't help, skip the batch instead of blocking on it
+                logging.error("InfluxDB rejected %d points: %s", len(lines), e.body)
+                self.spool.count_dropped(len(lines))
+            self.spool.commit(position)
+        self.client.close()
+        logging.info("InfluxDB pusher stopped")
 
 
 if __name__ == "__main__":
@@ -129,7 +123,99 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--influxdb-url", default="http://influxdb.iot.svc:8086")
+    parser.add_argument(
+        "--influxdb-batch-size",
+        type=int,
+        default=1000,
+        help="Max number of points sent to InfluxDB in a single request",
+    )
+    parser.add_argument(
+        "--influxdb-batch-bytes",
+        type=int,
+        default=1024 * 1024,
+        help="Max size (in bytes) of line protocol sent in a single request",
+    )
+    parser.add_argument(
+        "--influxdb-flush-interval",
+        type=float,
+        default=1.0,
+        help="Max time (in seconds) a point waits for the batch to fill up",
+    )
+    parser.add_argument(
+        "--spool-dir",
+        help="Buffer points on disk in this directory instead of memory, survives restarts and InfluxDB outages",
+    )
+    parser.add_argument(
+        "--spool-segment-bytes",
+        type=int,
+        default=16 * 1024 * 1024,
+        help="Size of a single spool segment file",
+    )
+    parser.add_argument(
+        "--spool-max-bytes",
+        type=int,
+        default=1024 * 1024 * 1024,
+        help="Max size of all spool segments on disk",
+    )
+    parser.add_argument(
+        "--spool-drop-policy",
+        choices=["oldest", "newest"],
+        default="oldest",
+        help="What to drop when the spool is full: oldest segment or incoming points",
+    )
+    parser.add_argument(
+        "--filters",
+        help="JSON file with per-measurement deduplication and change-only filters",
+    )
+    parser.add_argument(
+        "--rollup-windows",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Also write smartplugsensor min/max/mean/last in windows of these sizes (seconds), e.g. 60 900",
+    )
+    parser.add_argument(
+        "--rollup-fields",
+        nargs="*",
+        default=["power", "voltage", "current"],
+        help="smartplugsensor fields to roll up",
+    )
     parser.add_argument("--mqtt-topic", default="tele/#")
+    parser.add_argument(
+        "--ignore-topic",
+        action="append",
+        default=[],
+        help="MQTT topic filter (+ and # wildcards allowed) to skip, can be repeated",
+    )
+    parser.add_argument(
+        "--parser-plugin",
+        action="append",
+        default=[],
+        help="Module registering extra parsers with parsers.router.route, can be repeated",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Number of parser threads, messages are sharded between them by device. 0 parses in the MQTT thread",
+    )
+    parser.add_argument(
+        "--worker-queue-size",
+        type=int,
+        default=10000,
+        help="Max number of messages waiting for a single parser thread",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=60,
+        help="How often (in seconds) to log parser threads stats, 0 disables it",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Expose Prometheus metrics on this port",
+    )
     parser.add_argument("--mqtt-client-id", default="MQTTInfluxDBBridge")
     parser.add_argument("--mqtt-host", default="mosquitto-internal")
     parser.add_argument("--mqtt-port", type=int, default=1884)
@@ -139,9 +225,42 @@ if __name__ == "__main__":
     args = parser.parse_args()
     logging.info("Starting MQTT to InfluxDB bridge, %s", args)
 
-    influxdb_pusher = InfluxAsyncPusher(args)
+    for plugin in args.parser_plugin:
+        importlib.import_module(plugin)
+    for topic_filter in args.ignore_topic:
+        router.ignore(topic_filter)
+    if args.filters is not None:
+        filters.configure(args.filters, SCHEMAS)
+    if args.rollup_windows:
+        rollups.configure(
+            SCHEMAS["smartplugsensor"], args.rollup_fields, args.rollup_windows
+        )
+
+    if args.spool_dir is None:
+        spool = MemorySpool()
+    else:
+        spool = DiskSpool(
+            args.spool_dir,
+            args.spool_segment_bytes,
+            args.spool_max_bytes,
+            args.spool_drop_policy,
+        )
+    influxdb_pusher = InfluxAsyncPusher(args, spool)
     influxdb_pusher.start()
 
+    if args.workers > 0:
+        worker_pool = ShardedPool(
+            args.workers, on_message_handling_exceptions, args.worker_queue_size
+        )
+        worker_pool.start()
+        if args.stats_interval > 0:
+            threading.Thread(
+                target=log_stats_periodically, args=(args.stats_interval,), daemon=True
+            ).start()
+
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port, spool, worker_pool)
+
     mqtt_client = mqtt.Client(args.mqtt_client_id)
     if args.mqtt_ca_crt and args.mqtt_client_crt and args.mqtt_client_key:
         mqtt_client.tls_set(
@@ -150,6 +269,19 @@ if __name__ == "__main__":
             args.mqtt_client_key,
         )
     mqtt_client.on_connect = on_connect
-    mqtt_client.on_message = on_message_handling_exceptions
+    mqtt_client.on_message = (
+        on_message_handling_exceptions if worker_pool is None else on_message_in_pool
+    )
     mqtt_client.connect(args.mqtt_host, args.mqtt_port)
-    mqtt_client.loop_forever()
+    signal.signal(signal.SIGTERM, lambda signum, frame: mqtt_client.disconnect())
+    try:
+        mqtt_client.loop_forever()
+    except KeyboardInterrupt:
+        mqtt_client.disconnect()
+    finally:
+        if worker_pool is not None:
+            worker_pool.stop()
+        logging.info("Flushing pending points to InfluxDB")
+        influxdb_pusher.stop()
+        # with disk spool pending points are safe, don't wait for InfluxDB forever
+        influxdb_pusher.join(None if args.spool_dir is None else 30)
@@ -0,0 +1,92 @@
+from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from parsers import SCHEMAS
+
+MESSAGES_RECEIVED = Counter(
+    "mqttbridge_messages_received_total",
+    "MQTT messages received, by parser handling them",
+    ["parser"],
+)
+PARSE_ERRORS = Counter(
+    "mqttbridge_parse_errors_total", "MQTT messages which failed to parse"
+)
+PARSE_SECONDS = Histogram(
+    "mqttbridge_parse_seconds",
+    "Time spent decoding and parsing a single message",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+)
+WRITE_BATCH_SIZE = Histogram(
+    "mqttbridge_write_batch_size",
+    "Number of points written to InfluxDB in a single request",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+WRITE_SECONDS = Histogram(
+    "mqttbridge_write_seconds", "Time of a single InfluxDB write attempt"
+)
+WRITE_RETRIES = Counter(
+    "mqttbridge_write_retries_total", "Failed InfluxDB writes which are retried"
+)
+
+
+def parser_name(parser):
+    return "ignored" if parser is None else parser.__name__
+
+
+def count_retry(details):
+    WRITE_RETRIES.inc()
+
+
+class BridgeCollector:
+    """Reads queue depths and drop counts straight from the spool and worker pool"""
+
+    def __init__(self, spool, pool=None):
+        self.spool = spool
+        self.pool = pool
+
+    def collect(self):
+        yield GaugeMetricFamily(
+            "mqttbridge_queue_depth",
+            "Points waiting to be written to InfluxDB",
+            value=self.spool.depth(),
+        )
+        yield CounterMetricFamily(
+            "mqttbridge_dropped_points",
+            "Points dropped because the spool was full or InfluxDB rejected them",
+            value=self.spool.dropped,
+        )
+        filtered = CounterMetricFamily(
+            "mqttbridge_filtered",
+            "Duplicated lines and unchanged field values which were not written",
+            labels=["measurement", "reason"],
+        )
+        for schema in SCHEMAS.values():
+            if schema.filter is not None:
+                filtered.add_metric(
+                    [schema.name, "duplicate"], schema.filter.duplicates
+                )
+                filtered.add_metric(
+                    [schema.name, "unchanged"], schema.filter.suppressed
+                )
+        yield filtered
+        if self.pool is not None:
+            depth = GaugeMetricFamily(
+                "mqttbridge_shard_queue_depth",
+                "Messages waiting for a parser thread",
+                labels=["shard"],
+            )
+            latency = GaugeMetricFamily(
+                "mqttbridge_shard_latency_seconds",
+                "Moving average of time from receiving to parsing a message",
+                labels=["shard"],
+            )
+            for i, shard in enumerate(self.pool.shards):
+                depth.add_metric([str(i)], shard.queue.qsize())
+                latency.add_metric([str(i)], shard.latency)
+            yield depth
+            yield latency
+
+
+def serve(port, spool, pool=None):
+    REGISTRY.register(BridgeCollector(spool, pool))
+    start_http_server(port)
@@ -0,0 +1,93 @@
+from lineprotocol import Schema
+from router import TopicRouter
+from timeparse import LocalClock
+
+IGNORED_TOPICS = [
+    "tele/ecoal/STATE",  # not using ecoal anymore :-)
+]
+
+clock = LocalClock("Europe/Warsaw")
+
+router = TopicRouter()
+for topic_filter in IGNORED_TOPICS:
+    router.ignore(topic_filter)
+
+MITEMP = Schema(
+    "mitemperature",
+    tags=["room"],
+    fields=[
+        ("temperature", "temperature"),
+        ("humidity", "humidity"),
+        ("batt_voltage", "batt_voltage"),
+        ("batt_level", "batt_level"),
+    ],
+)
+
+SMARTPLUG_STATE = Schema(
+    "smartplugstate",
+    tags=["spid"],
+    fields=[
+        ("uptime_sec", "UptimeSec"),
+        ("heap", "Heap"),
+        ("sleep_mode", "SleepMode"),
+        ("sleep", "Sleep"),
+        ("loadavg", "LoadAvg"),
+        ("mqtt_count", "MqttCount"),
+        ("power", "POWER"),
+        ("is_on", lambda msg: msg["POWER"] == "ON"),
+        ("wifi_channel", ("Wifi", "Channel")),
+        ("wifi_rssi", ("Wifi", "RSSI")),
+        ("wifi_signal", ("Wifi", "Signal")),
+        ("wifi_link_count", ("Wifi", "LinkCount")),
+    ],
+)
+
+SMARTPLUG_SENSOR = Schema(
+    "smartplugsensor",
+    tags=["spid"],
+    fields=[
+        ("total_start_time", "TotalStartTime"),
+        ("total", "Total"),
+        ("yesterday", "Yesterday"),
+        ("today", "Today"),
+        ("period", "Period"),
+        ("power", "Power"),
+        ("apparent_power", "ApparentPower"),
+        ("reactive_power", "ReactivePower"),
+        ("factor", "Factor"),
+        ("voltage", "Voltage"),
+        ("current", "Current"),
+    ],
+)
+
+SCHEMAS = {
+    schema.name: schema for schema in [MITEMP, SMARTPLUG_STATE, SMARTPLUG_SENSOR]
+}
+
+
+def parse_time(time):
+    return clock.localize(time)
+
+
+@router.route("tele/temp/+")
+def parse_mitemp_msg(topic, msg):
+    sensor_name = topic.split("/")[-1]
+    return MITEMP.encode(
+        (sensor_name,), msg, int(round(msg["timestamp"] * 1000000)) * 1000
+    )
+
+
+@router.route("tele/+/+/STATE")
+def parse_state_msg(topic, msg):
+    return SMARTPLUG_STATE.encode(
+        (int(topic.split("/")[2]),), msg, clock.epoch_ns(msg["Time"])
+    )
+
+
+@router.route("tele/+/+/SENSOR")
+def parse_sensor_msg(topic, msg):
+    return SMARTPLUG_SENSOR.encode(
+        (int(topic.split("/")[2]),),
+        msg["ENERGY"],
+        clock.epoch_ns(msg["Time"]),
+    )
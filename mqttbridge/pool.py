@@ -0,0 +1,79 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+
+
+def device_key(topic):
+    """Device part of the topic: spid in tele/<name>/<spid>/STATE, room in tele/temp/<room>"""
+    levels = topic.split("/")
+    return levels[2] if len(levels) > 2 else topic
+
+
+class Shard(threading.Thread):
+    def __init__(self, index, handler, queue_size):
+        super().__init__(name=f"shard-{index}", daemon=True)
+        self.handler = handler
+        self.queue = queue.Queue(queue_size)
+        self.processed = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            received, args = item
+            self.handler(*args)
+            latency = time.monotonic() - received
+            self.processed += 1
+            self.latency += (latency - self.latency) * 0.05
+            self.max_latency = max(self.max_latency, latency)
+
+
+class ShardedPool:
+    """Runs handler on a pool of threads, messages of one device always go to the
+    same thread, so they are handled in order"""
+
+    def __init__(self, workers, handler, queue_size=10000):
+        self.shards = [Shard(i, handler, queue_size) for i in range(workers)]
+
+    def start(self):
+        for shard in self.shards:
+            shard.start()
+
+    def submit(self, topic, *args):
+        shard = self.shards[zlib.crc32(device_key(topic).encode()) % len(self.shards)]
+        shard.queue.put((time.monotonic(), args))
+
+    def stats(self):
+        """Returns queue depth, processed count, average and max latency of each shard.
+
+        Max latency is reset on every call.
+        """
+        stats = []
+        for shard in self.shards:
+            stats.append(
+                (shard.queue.qsize(), shard.processed, shard.latency, shard.max_latency)
+            )
+            shard.max_latency = 0.0
+        return stats
+
+    def log_stats(self):
+        for i, (depth, processed, latency, max_latency) in enumerate(self.stats()):
+            logging.info(
+                "Shard %d: queue depth %d, processed %d, latency avg %.1f ms, max %.1f ms",
+                i,
+                depth,
+                processed,
+                latency * 1000,
+                max_latency * 1000,
+            )
+
+    def stop(self):
+        for shard in self.shards:
+            shard.queue.put(None)
+        for shard in self.shards:
+            shard.join()
@@ -0,0 +1,130 @@
+import logging
+from collections import deque
+
+from lineprotocol import Schema
+
+AGGREGATES = ["min", "max", "mean", "last"]
+
+
+class Aggregate:
+    __slots__ = ("count", "sum", "min", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value):
+        if self.count == 0:
+            self.sum = self.min = self.max = value
+        else:
+            self.sum += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+        self.last = value
+        self.count += 1
+
+
+class Window:
+    __slots__ = ("start", "aggregates")
+
+    def __init__(self, fields):
+        self.start = None
+        self.aggregates = [Aggregate() for _ in range(fields)]
+
+    def reset(self, start):
+        self.start = start
+        for aggregate in self.aggregates:
+            aggregate.count = 0
+
+
+class Rollup:
+    """Tumbling window min/max/mean/last of chosen fields, next to raw data.
+
+    Every window of every series keeps a running aggregate, so memory doesn't
+    grow with the sample rate. A window is written (timestamped with its start)
+    when the first sample of the next one arrives; samples older than the
+    current window only go to raw data, repeated timestamps of a series are
+    counted once. Aggregates are always floats, to avoid
+    field type conflicts when Tasmota sends whole numbers.
+    """
+
+    def __init__(self, schema, fields, windows, dedupe_window=16):
+        self.fields = [(schema.field_names.index(name), name) for name in fields]
+        self.windows = [
+            (
+                seconds * 1000000000,
+                Schema(
+                    f"{schema.name}_{window_label(seconds)}",
+                    tags=schema.tag_names,
+                    fields=[
+                        (f"{name}_{aggregate}", f"{name}_{aggregate}")
+                        for name in fields
+                        for aggregate in AGGREGATES
+                    ],
+                ),
+            )
+            for seconds in windows
+        ]
+        self.series = {}
+        self.recent = {}
+        self.dedupe_window = dedupe_window
+
+    def __call__(self, tags, values, time_ns):
+        state = self.series.get(tags)
+        if state is None:
+            state = self.series[tags] = [Window(len(self.fields)) for _ in self.windows]
+            self.recent[tags] = deque(maxlen=self.dedupe_window)
+
+        # broker re-deliveries carry the same timestamp, count them once
+        recent = self.recent[tags]
+        if time_ns in recent:
+            return None
+        recent.append(time_ns)
+
+        lines = []
+        for (size, schema), window in zip(self.windows, state):
+            start = time_ns - time_ns % size
+            if window.start is None:
+                window.reset(start)
+            elif start > window.start:
+                lines.append(self.flush(schema, tags, window, start))
+            elif start < window.start:
+                continue
+            for aggregate, (index, _) in zip(window.aggregates, self.fields):
+                value = values[index]
+                if type(value) in (int, float):
+                    aggregate.add(float(value))
+
+        lines = [line for line in lines if line is not None]
+        return b"\n".join(lines) if lines else None
+
+    def flush(self, schema, tags, window, start):
+        """Encodes the window and starts the next one at start.
+
+        Fields with no numeric samples in the window are left out, the line
+        is None if none had any.
+        """
+        aggregates = {}
+        for aggregate, (_, name) in zip(window.aggregates, self.fields):
+            if aggregate.count > 0:
+                aggregates[f"{name}_min"] = aggregate.min
+                aggregates[f"{name}_max"] = aggregate.max
+                aggregates[f"{name}_mean"] = aggregate.sum / aggregate.count
+                aggregates[f"{name}_last"] = aggregate.last
+        time_ns = window.start
+        window.reset(start)
+        values = [aggregates.get(name) for name in schema.field_names]
+        return schema.encode_values(tags, values, time_ns)
+
+
+def window_label(seconds):
+    return f"{seconds // 60}m" if seconds % 60 == 0 else f"{seconds}s"
+
+
+def configure(schema, fields, windows):
+    schema.rollup = Rollup(schema, fields, windows)
+    logging.info(
+        "Rolling up %s of %s in %s windows",
+        fields,
+        schema.name,
+        [window_label(seconds) for seconds in windows],
+    )
@@ -0,0 +1,62 @@
+_NO_MATCH = object()
+_CACHE_SIZE = 10000
+
+
+class TopicRouter:
+    """Maps MQTT topic filters (with + and # wildcards) to handlers.
+
+    Filters are compiled into a trie keyed by topic level, so matching costs
+    O(topic depth) no matter how many filters are registered. Exact levels
+    win over +, which wins over #. A filter routed to None ignores the topic.
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.cache = {}
+
+    def add(self, topic_filter, handler):
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.setdefault(level, {})
+        node[None] = handler
+        self.cache.clear()
+
+    def ignore(self, topic_filter):
+        self.add(topic_filter, None)
+
+    def route(self, topic_filter):
+        def decorator(handler):
+            self.add(topic_filter, handler)
+            return handler
+
+        return decorator
+
+    def match(self, topic):
+        try:
+            return self.cache[topic]
+        except KeyError:
+            pass
+        handler = self._match(self.root, topic.split("/"), 0)
+        if handler is _NO_MATCH:
+            handler = None
+        if len(self.cache) >= _CACHE_SIZE:
+            self.cache.clear()
+        self.cache[topic] = handler
+        return handler
+
+    def _match(self, node, levels, depth):
+        if depth == len(levels):
+            handler = node.get(None, _NO_MATCH)
+            if handler is _NO_MATCH and "#" in node:
+                # "a/#" matches "a" as well
+                handler = node["#"].get(None, _NO_MATCH)
+            return handler
+
+        for key in (levels[depth], "+"):
+            if key in node:
+                handler = self._match(node[key], levels, depth + 1)
+                if handler is not _NO_MATCH:
+                    return handler
+        if "#" in node:
+            return node["#"].get(None, _NO_MATCH)
+        return _NO_MATCH
@@ -0,0 +1,251 @@
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+HEADER = struct.Struct("<I")
+
+
+class MemorySpool:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.carry = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, record):
+        self.queue.put(record)
+        return True
+
+    def close(self):
+        self.queue.put(None)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def get_batch(self, max_records, max_bytes, timeout):
+        if self.closed:
+            return [], None
+        record, self.carry = self.carry or self.queue.get(), None
+        if record is None:
+            self.closed = True
+            return [], None
+
+        records, size = [record], len(record)
+        deadline = time.monotonic() + timeout
+        while len(records) < max_records:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                record = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if record is None:
+                self.closed = True
+                break
+            if size + len(record) + 1 > max_bytes:
+                self.carry = record
+                break
+            records.append(record)
+            size += len(record) + 1
+        return records, None
+
+    def commit(self, position):
+        pass
+
+    def count_dropped(self, records):
+        self.dropped += records
+
+
+class DiskSpool:
+    """Append-only buffer of records, stored in size-rotated segment files.
+
+    Reading doesn't remove anything, records are gone only once their position
+    is committed, so a crash between read and commit replays them.
+    """
+
+    def __init__(self, directory, segment_bytes, max_bytes, drop_policy="oldest"):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.drop_policy = drop_policy
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+        self.segments = sorted(
+            int(name[:-4]) for name in os.listdir(directory) if name.endswith(".seg")
+        )
+        self.sizes = {}
+        self.counts = {}
+        for seq in self.segments:
+            self.sizes[seq], self.counts[seq] = self.scan(seq)
+
+        self.read_seq, self.read_offset, self.read_index = self.load_cursor()
+        for seq in [seq for seq in self.segments if seq < self.read_seq]:
+            self.remove(seq)
+
+        self.writer = None
+        self.write_seq = None
+        self.rotate()
+        if self.read_seq not in self.sizes:
+            self.read_seq, self.read_offset, self.read_index = self.segments[0], 0, 0
+        self.reader = open(self.path(self.read_seq), "rb")
+        logging.info(
+            "Spool opened in %s, %d records pending", self.directory, self.depth()
+        )
+
+    def path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.seg")
+
+    def scan(self, seq):
+        """Returns size and record count of a segment, ignoring the torn tail"""
+        size, count = 0, 0
+        with open(self.path(seq), "rb") as segment:
+            total = os.fstat(segment.fileno()).st_size
+            while size + HEADER.size <= total:
+                segment.seek(size)
+                (length,) = HEADER.unpack(segment.read(HEADER.size))
+                if size + HEADER.size + length > total:
+                    break
+                size += HEADER.size + length
+                count += 1
+        return size, count
+
+    def load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, "cursor")) as cursor:
+                seq, offset, index = map(int, cursor.read().split())
+                return seq, offset, index
+        except FileNotFoundError:
+            return -1, 0, 0
+
+    def save_cursor(self, position):
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "w") as cursor:
+            cursor.write("%d %d %d" % position)
+        os.replace(path + ".tmp", path)
+
+    def rotate(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.write_seq = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(self.write_seq)
+        self.sizes[self.write_seq] = 0
+        self.counts[self.write_seq] = 0
+        self.writer = open(self.path(self.write_seq), "wb")
+
+    def remove(self, seq):
+        self.segments.remove(seq)
+        del self.sizes[seq]
+        del self.counts[seq]
+        os.remove(self.path(seq))
+
+    def total_bytes(self):
+        return sum(self.sizes.values())
+
+    def depth(self):
+        return (
+            sum(self.counts[seq] for seq in self.segments if seq >= self.read_seq)
+            - self.read_index
+        )
+
+    def make_room(self, size):
+        if self.drop_policy != "oldest":
+            return False
+        while self.total_bytes() + size > self.max_bytes and len(self.segments) > 1:
+            seq = self.segments[0]
+            logging.warning(
+                "Spool full, dropping segment %d with %d records", seq, self.counts[seq]
+            )
+            self.dropped += self.counts[seq]
+            if seq == self.read_seq:
+                self.dropped -= self.read_index
+                self.move_reader(self.segments[1])
+            self.remove(seq)
+        return self.total_bytes() + size <= self.max_bytes
+
+    def put(self, record):
+        size = HEADER.size + len(record)
+        with self.cond:
+            if self.closed:
+                return False
+            if self.total_bytes() + size > self.max_bytes and not self.make_room(size):
+                self.dropped += 1
+                return False
+            if self.sizes[self.write_seq] >= self.segment_bytes:
+                self.rotate()
+            self.writer.write(HEADER.pack(len(record)) + record)
+            self.writer.flush()
+            self.sizes[self.write_seq] += size
+            self.counts[self.write_seq] += 1
+            self.cond.notify()
+        return True
+
+    def move_reader(self, seq):
+        self.reader.close()
+        self.reader = open(self.path(seq), "rb")
+        self.read_seq, self.read_offset, self.read_index = seq, 0, 0
+
+    def peek(self):
+        while True:
+            available = self.sizes[self.read_seq] - self.read_offset
+            if available > 0:
+                self.reader.seek(self.read_offset)
+                (length,) = HEADER.unpack(self.reader.read(HEADER.size))
+                return self.reader.read(length)
+            if self.read_seq == self.write_seq:
+                return None
+            self.move_reader(self.segments[self.segments.index(self.read_seq) + 1])
+
+    def advance(self, record):
+        self.read_offset += HEADER.size + len(record)
+        self.read_index += 1
+
+    def get_batch(self, max_records, max_bytes, timeout):
+        """Waits for the first record, then lingers up to timeout to fill the batch.
+
+        Returns records and a position to be committed once they are written.
+        """
+        records, size, deadline = [], 0, None
+        with self.cond:
+            while len(records) < max_records and not self.closed:
+                record = self.peek()
+                if record is None:
+                    remaining = (
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                    continue
+                if records and size + len(record) + 1 > max_bytes:
+                    break
+                self.advance(record)
+                records.append(record)
+                size += len(record) + 1
+                if deadline is None:
+                    deadline = time.monotonic() + timeout
+            return records, (self.read_seq, self.read_offset, self.read_index)
+
+    def commit(self, position):
+        with self.cond:
+            self.save_cursor(position)
+            for seq in [seq for seq in self.segments if seq < position[0]]:
+                self.remove(seq)
+
+    def count_dropped(self, records):
+        """Counts read records which won't be written as dropped"""
+        with self.cond:
+            self.dropped += records
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+            self.writer.close()
+            self.reader.close()
@@ -0,0 +1,42 @@
+import unittest
+
+from filters import ChangeFilter
+from lineprotocol import Schema
+
+
+class TestChangeFilter(unittest.TestCase):
+    def setUp(self):
+        self.schema = Schema(
+            "m", tags=["spid"], fields=[("heap", "heap"), ("uptime", "uptime")]
+        )
+        self.schema.filter = ChangeFilter(self.schema, {"heap": 2}, heartbeat=60)
+
+    def _encode(self, heap, uptime, time_s, spid=1):
+        return self.schema.encode(
+            (spid,), {"heap": heap, "uptime": uptime}, time_s * 10**9
+        )
+
+    def test_drops_redelivered_messages(self):
+        assert self._encode(20, 1, 10) is not None
+        assert self._encode(20, 1, 10) is None
+        assert self._encode(20, 1, 10, spid=2) is not None
+
+    def test_writes_field_only_when_out_of_deadband(self):
+        assert self._encode(20, 1, 10) == b"m,spid=1 heap=20i,uptime=1i 10000000000"
+        assert self._encode(22, 2, 20) == b"m,spid=1 uptime=2i 20000000000"
+        assert self._encode(23, 3, 30) == b"m,spid=1 heap=23i,uptime=3i 30000000000"
+
+    def test_writes_unchanged_field_after_heartbeat(self):
+        assert self._encode(20, 1, 10) is not None
+        assert self._encode(20, 2, 69) == b"m,spid=1 uptime=2i 69000000000"
+        assert self._encode(20, 3, 70) == b"m,spid=1 heap=20i,uptime=3i 70000000000"
+
+    def test_skips_line_when_nothing_changed(self):
+        schema = Schema("m", tags=["spid"], fields=[("heap", "heap")])
+        schema.filter = ChangeFilter(schema, {"heap": 0})
+        assert schema.encode((1,), {"heap": 20}, 10) is not None
+        assert schema.encode((1,), {"heap": 20}, 20) is None
+
+
+if __name__ == "__main__":
+    unittest.main()
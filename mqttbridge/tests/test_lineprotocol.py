@@ -0,0 +1,54 @@
+import unittest
+
+from influxdb_client import Point
+
+from lineprotocol import Schema
+
+SCHEMA = Schema(
+    "my measurement",
+    tags=["spid", "room"],
+    fields=[
+        ("int", "int"),
+        ("float", "float"),
+        ("bool", "bool"),
+        ("str", ("nested", "str")),
+        ("computed", lambda msg: msg["int"] > 0),
+    ],
+)
+
+
+class TestSchema(unittest.TestCase):
+    def _point(self, tags, msg, time_ns):
+        point = Point.measurement("my measurement").time(time_ns)
+        for key, value in tags.items():
+            point.tag(key, value)
+        return (
+            point.field("int", msg["int"])
+            .field("float", msg["float"])
+            .field("bool", msg["bool"])
+            .field("str", msg["nested"]["str"])
+            .field("computed", msg["int"] > 0)
+            .to_line_protocol()
+            .encode("utf-8")
+        )
+
+    def test_encodes_same_line_as_point(self):
+        for msg in [
+            {"int": 3, "float": 1.5, "bool": True, "nested": {"str": "ON"}},
+            {"int": -1, "float": 2.0, "bool": False, "nested": {"str": 'a "b" \\'}},
+            {"int": 0, "float": 1e-07, "bool": True, "nested": {"str": None}},
+            {"int": 0, "float": float("nan"), "bool": True, "nested": {"str": ""}},
+        ]:
+            for tags in [(3, "salon"), (3, "living room"), (None, "a,b=c")]:
+                expected = self._point(
+                    {"spid": tags[0], "room": tags[1]}, msg, 1713715200000000000
+                )
+                assert SCHEMA.encode(tags, msg, 1713715200000000000) == expected
+
+    def test_skips_line_without_fields(self):
+        schema = Schema("m", tags=[], fields=[("a", "a")])
+        assert schema.encode((), {"a": None}, 0) is None
+
+
+if __name__ == "__main__":
+    unittest.main()
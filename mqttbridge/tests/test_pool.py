@@ -0,0 +1,44 @@
+import threading
+import time
+import unittest
+
+from pool import ShardedPool, device_key
+
+
+class TestShardedPool(unittest.TestCase):
+    def test_keys_topics_by_device(self):
+        assert device_key("tele/smartplug/3/STATE") == "3"
+        assert device_key("tele/smartplug2/3/SENSOR") == "3"
+        assert device_key("tele/temp/salon") == "salon"
+        assert device_key("tele/LWT") == "tele/LWT"
+
+    def test_handles_messages_of_each_device_in_order_on_one_thread(self):
+        # given
+        handled = []
+        lock = threading.Lock()
+
+        def handler(device, seq):
+            time.sleep(0.0005 * (seq % 3))  # lets shards interleave
+            with lock:
+                handled.append((device, seq, threading.current_thread().name))
+
+        pool = ShardedPool(4, handler)
+        pool.start()
+
+        # when
+        for seq in range(50):
+            for device in range(8):
+                pool.submit(f"tele/smartplug/{device}/STATE", device, seq)
+        pool.stop()
+
+        # then
+        assert len(handled) == 400
+        assert len({name for _, _, name in handled}) > 1
+        for device in range(8):
+            of_device = [(seq, name) for d, seq, name in handled if d == device]
+            assert [seq for seq, _ in of_device] == list(range(50))
+            assert len({name for _, name in of_device}) == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
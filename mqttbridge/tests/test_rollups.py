@@ -0,0 +1,72 @@
+import unittest
+
+from lineprotocol import Schema
+from rollups import Rollup
+
+
+class TestRollup(unittest.TestCase):
+    def setUp(self):
+        self.schema = Schema(
+            "plug", tags=["spid"], fields=[("power", "power"), ("today", "today")]
+        )
+        self.schema.rollup = Rollup(self.schema, ["power"], [60, 900])
+
+    def _encode(self, power, time_s, spid=1):
+        return self.schema.encode(
+            (spid,), {"power": power, "today": 1.5}, time_s * 10**9
+        )
+
+    def test_writes_window_once_next_one_starts(self):
+        for time_s, power in [(0, 10), (20, 0), (40, 5.5)]:
+            assert b"\n" not in self._encode(power, time_s)
+
+        lines = self._encode(7, 60).split(b"\n")
+
+        assert lines == [
+            b"plug,spid=1 power=7i,today=1.5 60000000000",
+            b"plug_1m,spid=1 power_last=5.5,power_max=10,power_mean=5.166666666666667,"
+            b"power_min=0 0",
+        ]
+
+    def test_keeps_windows_per_series(self):
+        self._encode(10, 0, spid=1)
+        self._encode(20, 0, spid=2)
+
+        assert self._encode(1, 900, spid=2).split(b"\n")[1:] == [
+            b"plug_1m,spid=2 power_last=20,power_max=20,power_mean=20,power_min=20 0",
+            b"plug_15m,spid=2 power_last=20,power_max=20,power_mean=20,power_min=20 0",
+        ]
+
+    def test_counts_redelivered_samples_once(self):
+        for time_s, power in [(0, 10), (0, 10), (30, 100)]:
+            self._encode(power, time_s)
+
+        assert self._encode(1, 60).split(b"\n")[1] == (
+            b"plug_1m,spid=1 power_last=100,power_max=100,power_mean=55,power_min=10 0"
+        )
+
+    def test_late_samples_only_go_to_raw_data(self):
+        self._encode(10, 70)
+        assert self._encode(99, 10) == b"plug,spid=1 power=99i,today=1.5 10000000000"
+        assert self._encode(1, 120).split(b"\n")[1] == (
+            b"plug_1m,spid=1 power_last=10,power_max=10,power_mean=10,power_min=10 60000000000"
+        )
+
+    def test_skips_fields_without_numeric_samples(self):
+        self.schema.rollup = Rollup(self.schema, ["power", "today"], [60])
+        for time_s in (0, 60):
+            self.schema.encode((1,), {"power": 10, "today": None}, time_s * 10**9)
+
+        lines = self.schema.encode(
+            (1,), {"power": 20, "today": 1.5}, 120 * 10**9
+        ).split(b"\n")
+
+        assert lines == [
+            b"plug,spid=1 power=20i,today=1.5 120000000000",
+            b"plug_1m,spid=1 power_last=10,power_max=10,power_mean=10,power_min=10 "
+            b"60000000000",
+        ]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from router import TopicRouter
+
+
+class TestTopicRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = TopicRouter()
+        self.router.add("tele/+/+/STATE", "state")
+        self.router.add("tele/temp/+", "mitemp")
+        self.router.add("stat/#", "stat")
+        self.router.ignore("tele/ecoal/+/STATE")
+
+    def test_matches_single_level_wildcard(self):
+        assert self.router.match("tele/smartplug/3/STATE") == "state"
+        assert self.router.match("tele/temp/salon") == "mitemp"
+        assert self.router.match("tele/temp/salon/extra") is None
+
+    def test_matches_multi_level_wildcard_including_parent(self):
+        assert self.router.match("stat/smartplug/3/POWER") == "stat"
+        assert self.router.match("stat") == "stat"
+
+    def test_exact_level_wins_over_wildcard(self):
+        assert self.router.match("tele/ecoal/1/STATE") is None
+        assert self.router.match("tele/ecoalx/1/STATE") == "state"
+
+    def test_falls_back_to_wildcard_when_exact_branch_does_not_match(self):
+        self.router.add("tele/temp/salon/STATE", "salon")
+        assert self.router.match("tele/temp/salon/STATE") == "salon"
+        assert self.router.match("tele/temp/garaz/STATE") == "state"
+
+    def test_unknown_topics_are_not_routed(self):
+        assert self.router.match("tele/smartplug/3/LWT") is None
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import argparse
+import tempfile
+import unittest
+
+from benchmarks.stub import StubInfluxDB
+from main import InfluxAsyncPusher
+from spool import DiskSpool
+
+
+class TestDiskSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _spool(self, segment_bytes=100, max_bytes=10000, drop_policy="oldest"):
+        spool = DiskSpool(self.directory.name, segment_bytes, max_bytes, drop_policy)
+        self.addCleanup(spool.close)
+        return spool
+
+    def _pusher(self, influxdb, spool):
+        args = argparse.Namespace(
+            influxdb_url=influxdb.url,
+            influxdb_batch_size=10,
+            influxdb_batch_bytes=1024,
+            influxdb_flush_interval=0.05,
+        )
+        return InfluxAsyncPusher(args, spool)
+
+    def test_replays_uncommitted_records_after_restart(self):
+        # given
+        spool = self._spool()
+        for i in range(25):
+            spool.put(b"m v=%di" % i)
+        records, position = spool.get_batch(10, 1024, 0)
+        spool.commit(position)
+        spool.get_batch(10, 1024, 0)  # read, but never committed
+        spool.close()
+
+        # when
+        spool = self._spool()
+        records, _ = spool.get_batch(100, 10240, 0)
+
+        # then
+        assert records == [b"m v=%di" % i for i in range(10, 25)]
+
+    def test_drops_oldest_segment_when_full(self):
+        # given
+        spool = self._spool(segment_bytes=50, max_bytes=150)
+
+        # when
+        for i in range(20):
+            spool.put(b"m v=%02di" % i)
+
+        # then
+        records, _ = spool.get_batch(100, 10240, 0)
+        assert spool.dropped > 0
+        assert records == [b"m v=%02di" % i for i in range(spool.dropped, 20)]
+
+    def test_drops_incoming_records_when_full(self):
+        # given
+        spool = self._spool(segment_bytes=50, max_bytes=150, drop_policy="newest")
+
+        # when
+        accepted = [spool.put(b"m v=%02di" % i) for i in range(20)]
+
+        # then
+        records, _ = spool.get_batch(100, 10240, 0)
+        assert records == [b"m v=%02di" % i for i in range(accepted.count(True))]
+        assert spool.dropped == accepted.count(False)
+
+    def test_pushes_spooled_records_in_batches_once_influxdb_is_back(self):
+        # given
+        influxdb = StubInfluxDB(failures=2)
+        self.addCleanup(influxdb.shutdown)
+        spool = self._spool(segment_bytes=1000)
+        pusher = self._pusher(influxdb, spool)
+        for i in range(35):
+            spool.put(b"m v=%di" % i)
+
+        # when
+        pusher.start()
+        while spool.depth() > 0 or len(influxdb.lines) < 35:
+            pusher.join(0.1)
+        pusher.stop()
+        pusher.join()
+
+        # then
+        assert influxdb.lines == [b"m v=%di" % i for i in range(35)]
+        assert influxdb.requests == 2 + 4
+
+    def test_drops_batch_rejected_by_influxdb(self):
+        # given
+        influxdb = StubInfluxDB(failures=1, failure_status=400)
+        self.addCleanup(influxdb.shutdown)
+        spool = self._spool(segment_bytes=1000)
+        pusher = self._pusher(influxdb, spool)
+        for i in range(15):
+            spool.put(b"m v=%di" % i)
+
+        # when
+        pusher.start()
+        while spool.depth() > 0 or len(influxdb.lines) < 5:
+            pusher.join(0.1)
+        pusher.stop()
+        pusher.join()
+
+        # then
+        assert influxdb.lines == [b"m v=%di" % i for i in range(10, 15)]
+        assert influxdb.requests == 2
+        assert spool.dropped == 10
+
+
+if __name__ == "__main__":
+    unittest.main()
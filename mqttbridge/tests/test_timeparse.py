@@ -0,0 +1,62 @@
+import unittest
+from datetime import datetime, timedelta
+
+import pytz
+
+from lineprotocol import to_nanoseconds
+from timeparse import LocalClock
+
+
+class TestLocalClock(unittest.TestCase):
+    def setUp(self):
+        self.clock = LocalClock("Europe/Warsaw")
+        self.timezone = pytz.timezone("Europe/Warsaw")
+
+    def _expected(self, time):
+        return to_nanoseconds(self.timezone.localize(datetime.fromisoformat(time)))
+
+    def test_ambiguous_autumn_hour_is_standard_time(self):
+        # 02:00-03:00 happens twice on 2024-10-27, pytz picks CET (is_dst=False)
+        assert self.clock.epoch_ns("2024-10-27T01:59:59") == 1729987199 * 10**9
+        assert self.clock.epoch_ns("2024-10-27T02:00:00") == 1729990800 * 10**9
+        assert self.clock.epoch_ns("2024-10-27T02:30:00") == 1729992600 * 10**9
+        assert self.clock.epoch_ns("2024-10-27T03:00:00") == 1729994400 * 10**9
+
+    def test_matches_pytz_around_transitions(self):
+        for start in [datetime(2024, 3, 30, 22), datetime(2024, 10, 26, 22)]:
+            for minute in range(0, 8 * 60, 7):
+                time = (start + timedelta(minutes=minute)).isoformat()
+                assert self.clock.epoch_ns(time) == self._expected(time), time
+
+    def test_matches_pytz_across_years(self):
+        for day in range(0, 365 * 30, 11):
+            time = (datetime(2000, 1, 1, 12, 34, 56) + timedelta(days=day)).isoformat()
+            assert self.clock.epoch_ns(time) == self._expected(time), time
+
+    def test_parses_other_iso_formats(self):
+        assert self.clock.epoch_ns("2024-04-21T18:00:00.5") == self._expected(
+            "2024-04-21T18:00:00.5"
+        )
+        assert self.clock.epoch_ns("2024-04-21T18:00:00+00:00") == 1713722400 * 10**9
+
+    def test_rejects_invalid_dates(self):
+        for time in [
+            "2024-02-30T12:00:00",
+            "2023-02-29T12:00:00",
+            "2024-00-10T12:00:00",
+            "2024-04-00T12:00:00",
+            "2024-04-31T12:00:00",
+            "2024-04-21T-1:00:00",
+        ]:
+            with self.assertRaises(ValueError, msg=time):
+                self.clock.epoch_ns(time)
+        assert self.clock.epoch_ns("2024-02-29T12:00:00") == self._expected(
+            "2024-02-29T12:00:00"
+        )
+
+    def test_utc_zone(self):
+        assert LocalClock("UTC").epoch_ns("2024-04-21T18:00:00") == 1713722400 * 10**9
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import bisect
+import functools
+from datetime import datetime, timedelta
+
+import pytz
+
+from lineprotocol import to_nanoseconds
+
+_EPOCH = datetime(1970, 1, 1)
+_DAYS_IN_MONTH = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+
+def _days_from_civil(year, month, day):
+    """Days since 1970-01-01 in the proleptic Gregorian calendar"""
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def _days_in_month(year, month):
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return 29
+    return _DAYS_IN_MONTH[month - 1]
+
+
+def _seconds(naive):
+    return int((naive - _EPOCH).total_seconds())
+
+
+class LocalClock:
+    """Converts naive local timestamps (as sent by Tasmota) to UTC.
+
+    The zone is resolved once and split into DST periods, so the UTC offset of
+    a wall clock time is a bisect away. Times in the gap or the repeated hour
+    around a transition go through pytz, keeping its is_dst=False semantics.
+    """
+
+    def __init__(self, timezone):
+        self.timezone = pytz.timezone(timezone)
+        transitions = getattr(self.timezone, "_utc_transition_times", None)
+        if not transitions:
+            offset = _seconds(_EPOCH + self.timezone.utcoffset(_EPOCH))
+            self.starts, self.spans = [float("-inf")], [(float("inf"), offset)]
+            return
+
+        utc = [_seconds(transition) for transition in transitions[1:]]
+        offsets = [
+            int(info[0].total_seconds()) for info in self.timezone._transition_info
+        ]
+        # period i lasts from utc[i - 1] to utc[i] (UTC), only the part of it which
+        # doesn't overlap neighbours in local time maps to a single offset
+        self.starts, self.spans = [], []
+        for i, offset in enumerate(offsets):
+            start = (
+                float("-inf") if i == 0 else utc[i - 1] + max(offset, offsets[i - 1])
+            )
+            end = (
+                float("inf") if i == len(utc) else utc[i] + min(offset, offsets[i + 1])
+            )
+            if start < end:
+                self.starts.append(start)
+                self.spans.append((end, offset))
+
+    def utcoffset(self, local_seconds):
+        """UTC offset (in seconds) of a wall clock time given as seconds since epoch"""
+        i = bisect.bisect_right(self.starts, local_seconds) - 1
+        if i >= 0:
+            end, offset = self.spans[i]
+            if local_seconds < end:
+                return offset
+        naive = _EPOCH + timedelta(seconds=local_seconds)
+        return int(self.timezone.localize(naive).utcoffset().total_seconds())
+
+    def localize(self, time):
+        return self.timezone.localize(datetime.fromisoformat(time))
+
+    @functools.lru_cache(maxsize=4096)
+    def epoch_ns(self, time):
+        """Nanoseconds since epoch of an ISO timestamp, local unless it has an offset"""
+        if len(time) == 19 and time[4] == "-" and time[10] == "T" and time[13] == ":":
+            year, month, day = int(time[0:4]), int(time[5:7]), int(time[8:10])
+            hour, minute, second = int(time[11:13]), int(time[14:16]), int(time[17:19])
+            # anything else, e.g. 2024-02-30, is left to fromisoformat to reject
+            if (
+                year >= 1
+                and 1 <= month <= 12
+                and 1 <= day <= _days_in_month(year, month)
+                and 0 <= hour < 24
+                and 0 <= minute < 60
+                and 0 <= second < 60
+            ):
+                local = (
+                    _days_from_civil(year, month, day) * 86400
+                    + hour * 3600
+                    + minute * 60
+                    + second
+                )
+                return (local - self.utcoffset(local)) * 1000000000
+
+        parsed = datetime.fromisoformat(time)
+        if parsed.tzinfo is None:
+            parsed = self.timezone.localize(parsed)
+        return to_nanoseconds(parsed)